@@ -0,0 +1,139 @@
+"""Compares the layout engines on generated hierarchies.
+
+Each hierarchy level is a random left-to-right dataflow graph, shaped the way
+PyGears designs usually are: a pipeline of stages with broadcasts, joins,
+bypasses and an occasional feedback loop. Every level is laid out by each of
+the engines and the total time per engine is reported.
+
+Usage: python benchmarks/layout_bench.py [--levels N] [--nodes N] [--seed N]
+"""
+
+import argparse
+import random
+import time
+
+from gearbox.layout_engine import LAYOUT_ENGINES
+
+PORT_SIZE = 10.0
+
+
+class BenchNode:
+    """Node sizes and port placement as calculated by the graph view."""
+
+    def __init__(self, name, num_inputs, num_outputs):
+        self.width = 60.0 + 7.0 * len(name)
+        self.height = max(70.0, 2 * PORT_SIZE * (max(num_inputs, num_outputs) + 2) + 10)
+        self.inputs = self.place_ports(num_inputs)
+        self.outputs = self.place_ports(num_outputs)
+
+    def place_ports(self, num):
+        # Offsets of the port centers from the top of the node
+        chunk = (self.height - 35.0) / max(num, 1)
+        return [chunk * (i + 0.5) + 32.5 for i in range(num)]
+
+    def describe(self):
+        return {'size': [self.width, self.height], 'inputs': self.inputs, 'outputs': self.outputs}
+
+
+def generate_level(rnd, num_nodes, feedback=0.05):
+    num_inputs = rnd.randint(1, 3)
+    num_outputs = rnd.randint(1, 3)
+
+    # Stage of each node along the pipeline
+    stages = sorted(rnd.randint(0, max(1, num_nodes // 3)) for _ in range(num_nodes))
+
+    # Producers of each node's inputs, drawn from the earlier stages
+    sources = []
+    for i, stage in enumerate(stages):
+        earlier = [f'n{j}' for j in range(i) if stages[j] < stage]
+        if not earlier:
+            earlier = [f'i{k}' for k in range(num_inputs)]
+
+        count = 1 if rnd.random() < 0.6 else rnd.randint(2, 3)
+        sources.append([rnd.choice(earlier) for _ in range(count)])
+
+    consumers = {}
+    for i, srcs in enumerate(sources):
+        for src in srcs:
+            consumers.setdefault(src, []).append(f'n{i}')
+
+    outputs = [f'n{i}' for i in range(num_nodes) if f'n{i}' not in consumers]
+    sinks = [rnd.choice(outputs or [f'n{num_nodes - 1}']) for _ in range(num_outputs)]
+
+    num_node_outputs = [len(consumers.get(f'n{i}', ())) + sinks.count(f'n{i}')
+                        for i in range(num_nodes)]
+    nodes = [
+        BenchNode(f'stage{i}', len(srcs), max(1, num_node_outputs[i]))
+        for i, srcs in enumerate(sources)
+    ]
+
+    edges = []
+    out_index = [0] * num_nodes
+
+    def tail_of(src):
+        if src[0] == 'i':
+            return [src, '']
+
+        i = int(src[1:])
+        port = out_index[i]
+        out_index[i] += 1
+        return [src, f'o{port}']
+
+    for i, srcs in enumerate(sources):
+        for port, src in enumerate(srcs):
+            edges.append(tail_of(src) + [f'n{i}', f'i{port}'])
+
+    for port, src in enumerate(sinks):
+        edges.append(tail_of(src) + [f'o{port}', ''])
+
+    for i in range(num_nodes):
+        if rnd.random() < feedback and i > 0:
+            # Feedback from a later stage, as in the accumulators and the
+            # decoupled loops
+            j = rnd.randrange(i)
+            edges.append([f'n{i}', f'o{out_index[i] % len(nodes[i].outputs)}', f'n{j}', 'i0'])
+
+    return {
+        'nodes': [n.describe() for n in nodes],
+        'inputs': num_inputs,
+        'outputs': num_outputs,
+        'edges': edges
+    }
+
+
+def generate_hierarchy(rnd, levels, num_nodes):
+    descs = []
+    for level in range(levels):
+        # Deeper levels have more, but smaller hierarchical nodes
+        for _ in range(2**level):
+            descs.append(generate_level(rnd, max(2, num_nodes // (level + 1))))
+
+    return descs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--nodes', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', default=list(LAYOUT_ENGINES))
+    args = parser.parse_args()
+
+    descs = generate_hierarchy(random.Random(args.seed), args.levels, args.nodes)
+    num_nodes = sum(len(d['nodes']) for d in descs)
+    num_edges = sum(len(d['edges']) for d in descs)
+    print(f'{len(descs)} hierarchical nodes, {num_nodes} nodes, {num_edges} edges')
+
+    for engine in args.engines:
+        layout = LAYOUT_ENGINES[engine]
+        start = time.perf_counter()
+        for desc in descs:
+            layout(desc)
+
+        elapsed = time.perf_counter() - start
+        print(f'{engine:>10}: {elapsed:8.3f}s total, '
+              f'{1000 * elapsed / len(descs):8.2f}ms per hierarchical node')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Measures the memory taken by the graph models of a generated design.
+
+The design is a tree of hierarchical gears, each of which broadcasts its
+input to a number of subtrees and concatenates their outputs, down to the
+leaves made of registers. The models are built for the whole hierarchy,
+without the Qt items, and their size is reported per gear and per interface.
+
+Usage: python benchmarks/model_memory.py [--depth N] [--width N]
+"""
+
+import argparse
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+from pygears import gear, Intf, reg, clear
+from pygears.lib import ccat, dreg
+from pygears.typing import Uint
+
+from gearbox.node_model import NodeModel, PipeModel
+
+
+@gear
+def stage(din, *, depth, width):
+    if depth == 0:
+        return din | dreg
+
+    return ccat(*(din | stage(depth=depth - 1, width=width) for _ in range(width)))[0]
+
+
+def generate_design(depth, width):
+    clear()
+    stage(Intf(Uint[8]), depth=depth, width=width)
+    return reg['gear/root']
+
+
+def build_models(root):
+    reg['gearbox/graph_model_map'] = {}
+    reg['gearbox/sim_bridge'] = SimpleNamespace(cur_model_issue_path=[])
+    reg['gearbox/timekeep'] = None
+    reg['hdlgen/map'] = {}
+    reg['trace/issues'] = []
+
+    top = NodeModel(root)
+
+    # Only the top two levels are loaded eagerly, the rest is loaded when
+    # the views are expanded
+    unloaded = [top]
+    while unloaded:
+        model = unloaded.pop()
+        if not model.child and model.hierarchical:
+            model.load_children()
+
+        unloaded.extend(c for c in model.child if isinstance(c, NodeModel))
+
+    return top
+
+
+def model_bytes(model):
+    """Size of the model object together with the containers it owns."""
+
+    size = sys.getsizeof(model)
+    attrs = getattr(model, '__dict__', None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+    else:
+        attrs = {
+            name: getattr(model, name)
+            for cls in type(model).__mro__
+            for name in getattr(cls, '__slots__', ())
+            if hasattr(model, name)
+        }
+
+    for val in attrs.values():
+        if isinstance(val, (list, dict, tuple, str)):
+            size += sys.getsizeof(val)
+
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--width', type=int, default=4)
+    args = parser.parse_args()
+
+    root = generate_design(args.depth, args.width)
+
+    tracemalloc.start()
+    top = build_models(root)
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    models = {NodeModel: [], PipeModel: []}
+    stack = [top]
+    while stack:
+        model = stack.pop()
+        models[type(model)].append(model)
+        stack.extend(model.child)
+
+    # Names are memoized on the first access
+    for pipe in models[PipeModel]:
+        pipe.name
+        pipe.basename
+
+    gears = models[NodeModel]
+    intfs = models[PipeModel]
+    print(f'{len(gears)} gears, {len(intfs)} interfaces, {traced / 1024:.1f} KiB traced')
+    print(f'{"gear":>10}: {sum(map(model_bytes, gears)) / len(gears):8.1f} bytes')
+    print(f'{"interface":>10}: {sum(map(model_bytes, intfs)) / len(intfs):8.1f} bytes')
+
+    top.clear()
+
+
+if __name__ == '__main__':
+    main()
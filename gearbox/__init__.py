@@ -1,4 +1,13 @@
 # from gearbox.main import main, Gearbox
-from gearbox.main import main
 
 __all__ = ['main']
+
+
+def __getattr__(name):
+    # The GUI is imported lazily, so that the layout worker processes can load
+    # gearbox.layout_engine without pulling in PySide2 and pygears
+    if name == 'main':
+        from gearbox.main import main
+        return main
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
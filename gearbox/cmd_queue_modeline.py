@@ -0,0 +1,38 @@
+from PySide2 import QtCore
+from pygears.conf import reg
+
+
+class CmdQueueModeline(QtCore.QObject):
+    """Shows the state of the gtkwave command queue in the modeline."""
+
+    def __init__(self, buff):
+        super().__init__()
+        self.buff = buff
+        self.scheduler = buff.gtk_window.scheduler
+        self.buff.shown.connect(self.configure)
+        self.buff.hidden.connect(self.reset)
+
+        if self.buff.visible:
+            self.configure()
+
+    def configure(self):
+        if self.buff.window is None or not reg['gearbox/gtkwave/cmd_stats']:
+            return
+
+        self.buff.window.modeline.add_field('cmd_queue', '')
+        self.scheduler.stats_changed.connect(self.update)
+        self.update(self.scheduler.stats)
+
+    def reset(self):
+        try:
+            self.scheduler.stats_changed.disconnect(self.update)
+        except RuntimeError:
+            pass
+
+    def update(self, stats):
+        self.buff.window.modeline.set_field_text(
+            'cmd_queue', f'Queue: {stats["depth"]}, merged: {stats["merged"]}, '
+            f'dropped: {stats["dropped"]}')
+
+    def delete(self):
+        self.reset()
@@ -32,3 +32,7 @@ Z_VAL_PIPE = -1
 Z_VAL_NODE = 1
 Z_VAL_PORT = 2
 Z_VAL_NODE_WIDGET = 3
+
+# LEVEL OF DETAIL
+# Scale below which the items are drawn without text, ports and curves
+LOD_THRESHOLD = 0.4
@@ -1,7 +1,9 @@
 #!/usr/bin/python
 
 from PySide2 import QtCore, QtWidgets, QtGui
+import time
 import warnings
+from functools import partial
 
 from .constants import (IN_PORT, OUT_PORT, PIPE_LAYOUT_CURVED,
                         PIPE_LAYOUT_STRAIGHT, PIPE_DEFAULT_COLOR)
@@ -10,9 +12,11 @@ from .node_abstract import AbstractNodeItem
 from .pipe import Pipe
 from .port import PortItem
 from .scene import NodeScene
+from .paint_stats import PaintStats
 from .node import NodeItem
-from .node_model import NodeModel, find_cosim_modules
+from .node_model import NodeModel, ViewCache, find_cosim_modules
 from .layout import Buffer, LayoutPlugin
+from .layout_pipeline import LayoutPipeline, LayoutPlaceholder, PreLayout
 from .html_utils import tabulate, fontify
 from .utils import single_shot_connect
 
@@ -22,6 +26,13 @@ from pygears.hdl import hdlgen
 ZOOM_MIN = -0.95
 ZOOM_MAX = 2.0
 
+VIEWPORT_UPDATE_MODES = {
+    'full': QtWidgets.QGraphicsView.FullViewportUpdate,
+    'minimal': QtWidgets.QGraphicsView.MinimalViewportUpdate,
+    'smart': QtWidgets.QGraphicsView.SmartViewportUpdate,
+    'bounding': QtWidgets.QGraphicsView.BoundingRectViewportUpdate,
+}
+
 PIPE_WAITED_COLOR = (13, 232, 184, 255)
 PIPE_ACTIVE_COLOR = (232, 13, 184, 255)
 
@@ -47,6 +58,66 @@ class GraphBuffer(Buffer):
         return 'graph'
 
 
+class StatusTransaction:
+    """Collects the new statuses of the graph models and applies at once
+    only the ones that differ from the current state.
+
+    Used as a context manager, the statuses are committed on exit. The
+    changed models and their statuses are then announced with a single
+    Graph.statuses_changed signal.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.statuses = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def set_status(self, item, status):
+        self.statuses[item] = status
+
+    def changed(self):
+        """Items whose pending status differs from the current one."""
+
+        return [
+            item for item, status in self.statuses.items() if current_status(item) != status
+        ]
+
+    def status(self, item):
+        """Status of the item, as it will be after the commit."""
+
+        try:
+            return self.statuses[item]
+        except KeyError:
+            return current_status(item)
+
+    def commit(self):
+        changed = {item: self.statuses[item] for item in self.changed()}
+        self.statuses = {}
+
+        # Views only mark themselves dirty here, they are all repainted in a
+        # single pass once the control returns to the event loop
+        for item, status in changed.items():
+            item.set_status(status)
+
+        if changed:
+            self.graph.statuses_changed.emit(changed)
+
+        return changed
+
+
+def current_status(item):
+    if isinstance(item, NodeModel):
+        return item.status[1]
+    else:
+        return item.status
+
+
 @inject
 def graph(
         sim_bridge=Inject('gearbox/sim_bridge'),
@@ -88,6 +159,8 @@ class GraphModelCtrl(QtCore.QObject):
     @inject
     def __init__(self, sim_bridge=Inject('gearbox/sim_bridge')):
         super().__init__()
+        self.pipeline = None
+        self.prelayout = None
         self.sim_bridge = sim_bridge
         self.sim_bridge.model_loaded.connect(self.graph_create)
         self.sim_bridge.model_closed.connect(self.graph_delete)
@@ -99,34 +172,74 @@ class GraphModelCtrl(QtCore.QObject):
 
         reg['gearbox/graph'] = view
         reg['gearbox/graph_model_map'] = {}
+        reg['gearbox/graph_view_cache'] = ViewCache(reg['gearbox/graph/view_cache'])
 
         for m in find_cosim_modules():
             hdlgen(m.top, generate=False, lang=m.lang, copy_files=False, toplang='v')
 
         top_model = NodeModel(root)
+        top_model.create_view()
+        top_model.create_child_views()
         reg['gearbox/graph_model'] = top_model
         view.top = top_model.view
-        top_model.view.layout()
-        view.fit_all()
 
         self.buff = GraphBuffer(view, 'graph')
 
-        if not self.err:
-            self.graph_loaded.emit()
+        if reg['gearbox/graph_layout/background']:
+            self.layout_in_background(view)
+        else:
+            top_model.view.layout()
+            self.graph_laid_out(view)
 
         return self.buff
 
+    def layout_in_background(self, view):
+        view.top.hide()
+        placeholder = LayoutPlaceholder(view.scene())
+
+        self.pipeline = LayoutPipeline(view.top)
+        self.pipeline.progress.connect(placeholder.progress)
+        self.pipeline.done.connect(partial(self.graph_laid_out, view, placeholder))
+        self.pipeline.start()
+
+    def graph_laid_out(self, view, placeholder=None):
+        self.pipeline = None
+
+        if placeholder is not None:
+            placeholder.delete()
+            view.top.show()
+
+        view.fit_all()
+
+        if reg['gearbox/graph_layout/prelayout'] and reg['gearbox/graph_layout/cache']:
+            self.prelayout = PreLayout(reg['gearbox/graph_model'])
+
+        if not self.err:
+            self.graph_loaded.emit()
+
     @property
     def err(self):
         return self.sim_bridge.err
 
     def graph_delete(self):
         print(f'Deleting graph')
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+            self.pipeline = None
+
+        if self.prelayout is not None:
+            self.prelayout.cancel()
+            self.prelayout = None
+
         self.buff.delete()
         del self.buff
+        # Models reference each other and their views, so the whole graph is
+        # freed at once here, instead of waiting for the garbage collector
+        reg['gearbox/graph_model'].clear()
         reg['gearbox/graph'] = None
         reg['gearbox/graph_model'] = None
         reg['gearbox/graph_model_map'] = {}
+        reg['gearbox/graph_view_cache'].clear()
         self.graph_closed.emit()
 
 
@@ -138,9 +251,13 @@ class Graph(QtWidgets.QGraphicsView):
     node_selected = QtCore.Signal(str)
     resized = QtCore.Signal()
     node_expand_toggled = QtCore.Signal(bool, object)
+    statuses_changed = QtCore.Signal(dict)
 
     @inject
-    def __init__(self, parent=None):
+    def __init__(self,
+                 parent=None,
+                 viewport_update=Inject('gearbox/graph/viewport_update'),
+                 paint_stats=Inject('gearbox/graph/paint_stats')):
         super().__init__(parent)
         self.setScene(NodeScene(self))
         self.scene().selectionChanged.connect(self.selection_changed_slot)
@@ -151,7 +268,8 @@ class Graph(QtWidgets.QGraphicsView):
         self.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.setResizeAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
         self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
-        self.setViewportUpdateMode(QtWidgets.QGraphicsView.FullViewportUpdate)
+        self.setViewportUpdateMode(VIEWPORT_UPDATE_MODES[viewport_update])
+        self.paint_stats = PaintStats(self) if paint_stats else None
         self._pipe_layout = PIPE_LAYOUT_STRAIGHT
         self._live_pipe = None
         self._detached_port = None
@@ -310,6 +428,38 @@ class Graph(QtWidgets.QGraphicsView):
         self._previous_pos = event.pos()
         super().mouseMoveEvent(event)
 
+    def status_transaction(self):
+        return StatusTransaction(self)
+
+    def paintEvent(self, event):
+        if self.paint_stats is None:
+            return super().paintEvent(event)
+
+        start = time.perf_counter()
+        super().paintEvent(event)
+        self.paint_stats.painted(event.rect(), time.perf_counter() - start)
+
+    def drawForeground(self, painter, rect):
+        super().drawForeground(painter, rect)
+        if self.paint_stats is None:
+            return
+
+        # Overlay is fixed to the viewport, so it is drawn in view coordinates
+        painter.save()
+        painter.resetTransform()
+        self.paint_stats.draw(painter)
+        painter.restore()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        if self.paint_stats is None:
+            return
+
+        # Scrolling copies the overlay along with the scene, so both the copy
+        # and the overlay itself need to be repainted
+        overlay = self.paint_stats.rect
+        self.viewport().update(overlay.united(overlay.translated(dx, dy)))
+
     def wheelEvent(self, event):
         adjust = (event.delta() / 120) * 0.1
         self._set_viewer_zoom(adjust)
@@ -505,3 +655,11 @@ class GraphBufferPlugin(LayoutPlugin):
     @classmethod
     def bind(cls):
         reg['gearbox/plugins/graph'] = {}
+        # Number of the collapsed hierarchical nodes that keep the Qt items of
+        # their subtrees, None to keep all of them
+        reg.confdef('gearbox/graph/view_cache', default=32)
+        # How the graph view repaints the changed items, one of the
+        # VIEWPORT_UPDATE_MODES
+        reg.confdef('gearbox/graph/viewport_update', default='smart')
+        # Show the frame rate and the repaint time in the graph view
+        reg.confdef('gearbox/graph/paint_stats', default=False)
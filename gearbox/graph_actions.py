@@ -67,20 +67,15 @@ def node_right(node, graph):
     if isinstance(node, Pipe):
         return
 
-    layer_id, layer, node_id = get_node_layer(node)
+    layers = node.parent.layers
+    layer_id, node_id = layers.locate(node)
 
-    if layer_id == len(node.parent.layers) - 1:
+    if layer_id == len(layers) - 1:
         layer_id = 0
     else:
         layer_id += 1
 
-    closest = node.parent.layers[layer_id][0]
-
-    for n in node.parent.layers[layer_id][1:]:
-        if abs(node.y() - n.y()) < abs(node.y() - closest.y()):
-            closest = n
-
-    graph.select(closest)
+    graph.select(layers.closest(layer_id, node.y()))
 
 
 @shortcut('graph', Qt.Key_H)
@@ -89,28 +84,15 @@ def node_left(node, graph):
     if isinstance(node, Pipe):
         return
 
-    layer_id, layer, node_id = get_node_layer(node)
+    layers = node.parent.layers
+    layer_id, node_id = layers.locate(node)
 
     if layer_id == 0:
-        layer_id = len(node.parent.layers) - 1
+        layer_id = len(layers) - 1
     else:
         layer_id -= 1
 
-    closest = node.parent.layers[layer_id][0]
-
-    for n in node.parent.layers[layer_id][1:]:
-        if abs(node.y() - n.y()) < abs(node.y() - closest.y()):
-            closest = n
-
-    graph.select(closest)
-
-
-def get_node_layer(node):
-    for i, layer in enumerate(node.parent.layers):
-        if node in layer:
-            return i, layer, layer.index(node)
-    else:
-        return None
+    graph.select(layers.closest(layer_id, node.y()))
 
 
 register_prefix('graph', Qt.Key_Z, 'zoom')
@@ -141,16 +123,17 @@ def node_up(graph=Inject('gearbox/graph')):
         return
 
     node = nodes[0]
-    layer_id, layer, node_id = get_node_layer(node)
+    layers = node.parent.layers
+    layer_id, node_id = layers.locate(node)
     if node_id == 0:
         if layer_id == 0:
-            layer_id = len(node.parent.layers) - 1
+            layer_id = len(layers) - 1
         else:
             layer_id -= 1
 
-        node = node.parent.layers[layer_id][-1]
+        node = layers[layer_id][-1]
     else:
-        node = node.parent.layers[layer_id][node_id - 1]
+        node = layers[layer_id][node_id - 1]
 
     graph.select(node)
 
@@ -167,16 +150,17 @@ def node_down(graph=Inject('gearbox/graph')):
         return
 
     node = nodes[0]
-    layer_id, layer, node_id = get_node_layer(node)
-    if node_id == len(layer) - 1:
-        if layer_id == len(node.parent.layers) - 1:
+    layers = node.parent.layers
+    layer_id, node_id = layers.locate(node)
+    if node_id == len(layers[layer_id]) - 1:
+        if layer_id == len(layers) - 1:
             layer_id = 0
         else:
             layer_id += 1
 
-        node = node.parent.layers[layer_id][0]
+        node = layers[layer_id][0]
     else:
-        node = node.parent.layers[layer_id][node_id + 1]
+        node = layers[layer_id][node_id + 1]
 
     graph.select(node)
 
@@ -343,6 +327,52 @@ def node_search(minibuffer=Inject('gearbox/minibuffer'),
     graph.select(node.view)
 
 
+register_prefix('graph', Qt.Key_M, 'heatmap')
+
+
+def toggle_heatmap(metric):
+    if reg['gearbox/heatmap/metric'] == metric:
+        metric = None
+
+    reg['gearbox/heatmap/metric'] = metric
+
+    if metric is None:
+        message('Heatmap off')
+    else:
+        message(f'Heatmap: {metric} over {reg["gearbox/heatmap/window"]} cycles')
+
+
+@shortcut('graph', (Qt.Key_M, Qt.Key_T))
+def heatmap_throughput():
+    toggle_heatmap('throughput')
+
+
+@shortcut('graph', (Qt.Key_M, Qt.Key_W))
+def heatmap_waited():
+    toggle_heatmap('waited')
+
+
+@shortcut('graph', (Qt.Key_M, Qt.Key_S))
+def heatmap_stalled():
+    toggle_heatmap('stalled')
+
+
+@shortcut('graph', (Qt.Key_M, Qt.Key_M))
+def heatmap_off():
+    toggle_heatmap(None)
+
+
+@shortcut('graph', (Qt.Key_M, Qt.Key_R))
+def heatmap_window(window=Interactive('Heatmap window: ')):
+    try:
+        window = int(window)
+    except (TypeError, ValueError):
+        return
+
+    if window > 0:
+        reg['gearbox/heatmap/window'] = window
+
+
 class GraphDescription:
     def __init__(self, buff):
         self.buff = buff
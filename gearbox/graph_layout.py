@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+from pygears.conf import Inject, MayInject, PluginBase, inject, reg
+
+from .layout_engine import run_layout
+
+# Bumped whenever the layout description or the geometry format changes, so
+# that the stale cache entries are not picked up
+LAYOUT_CACHE_VERSION = 3
+
+
+def layout_key(desc, engine):
+    data = json.dumps([LAYOUT_CACHE_VERSION, engine, desc], sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+class LayoutCache:
+    """Geometry of the already laid out hierarchical nodes.
+
+    Entries are keyed by the hash of the layout description, so any change to
+    the structure of the node, sizes of its children or their ports misses
+    the cache. Entries are kept in memory and, if the results directory is
+    set, also on disk so that they survive the restart.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    @property
+    @inject
+    def cache_dir(self, outdir=MayInject('results-dir')):
+        if outdir is None:
+            return None
+
+        return os.path.join(outdir, 'gearbox', 'layout')
+
+    def get(self, key):
+        if key in self.entries:
+            return self.entries[key]
+
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            return None
+
+        try:
+            with open(os.path.join(cache_dir, f'{key}.json')) as f:
+                geometry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self.entries[key] = geometry
+        return geometry
+
+    def put(self, key, geometry):
+        self.entries[key] = geometry
+
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            return
+
+        fn = os.path.join(cache_dir, f'{key}.json')
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temporary file first so that a concurrently running
+            # gearbox never reads a partially written entry
+            with open(f'{fn}.{os.getpid()}.tmp', 'w') as f:
+                json.dump(geometry, f)
+
+            os.replace(f'{fn}.{os.getpid()}.tmp', fn)
+        except OSError as e:
+            print(f'Layout cache write failed: {e}')
+
+
+def cached_layout(desc, engine):
+    """Returns the cache key of the description and the cached geometry, or
+    None for the geometry if it needs to be laid out."""
+
+    if not reg['gearbox/graph_layout/cache']:
+        return None, None
+
+    key = layout_key(desc, engine)
+    return key, reg['gearbox/graph_layout/cache_inst'].get(key)
+
+
+def cache_layout(key, geometry):
+    if key is not None:
+        reg['gearbox/graph_layout/cache_inst'].put(key, geometry)
+
+
+@inject
+def graph_layout(desc, engine=Inject('gearbox/graph_layout/engine')):
+    key, geometry = cached_layout(desc, engine)
+    if geometry is None:
+        geometry = run_layout(desc, engine)
+        cache_layout(key, geometry)
+
+    return geometry
+
+
+class GraphLayoutPlugin(PluginBase):
+    @classmethod
+    def bind(cls):
+        # One of the LAYOUT_ENGINES
+        reg.confdef('gearbox/graph_layout/engine', default='dot')
+        reg.confdef('gearbox/graph_layout/cache', default=True)
+        # Lay out the graph in worker threads while showing the progress
+        reg.confdef('gearbox/graph_layout/background', default=True)
+        reg.confdef('gearbox/graph_layout/workers', default=4)
+        # Speculatively lay out all hierarchy levels after the graph is loaded
+        reg.confdef('gearbox/graph_layout/prelayout', default=False)
+        reg.confdef('gearbox/graph_layout/prelayout_workers', default=os.cpu_count())
+        # Address space limit of each pre-layout worker in MB, None for no limit
+        reg.confdef('gearbox/graph_layout/prelayout_mem', default=1024)
+        reg['gearbox/graph_layout/cache_inst'] = LayoutCache()
@@ -16,6 +16,10 @@ from .utils import single_shot_connect
 from .dbg import dbg_connect
 from functools import partial
 from .gtkwave_vcd import PyGearsVCDMap, VerilatorVCDMap
+from .vcd_index import VCDTailer
+from .handshake import HandshakeTimelines
+from .heatmap import HEATMAP_METRICS, heatmap_update
+from .trace_columnar import ColumnarTrace, columnar_trace_fn, fst_trace_fn
 import os
 
 
@@ -34,20 +38,29 @@ def gtkwave(graph_model_ctrl=Inject('gearbox/graph_model_ctrl')):
 
 
 @inject
-def gtkwave_create(graph_model_ctrl=Inject('gearbox/graph_model_ctrl')):
+def gtkwave_create(graph_model_ctrl=Inject('gearbox/graph_model_ctrl'),
+                   sim_bridge=Inject('gearbox/sim_bridge')):
     gtkwave = GtkWave()
     reg['gearbox/gtkwave/inst'] = gtkwave
+    sim_bridge.traces_compacted.connect(gtkwave.traces_compacted)
     single_shot_connect(graph_model_ctrl.graph_closed, gktwave_delete)
 
 
 @inject
-def gktwave_delete(timekeep=Inject('gearbox/timekeep')):
+def gktwave_delete(timekeep=Inject('gearbox/timekeep'),
+                   sim_bridge=Inject('gearbox/sim_bridge')):
     print('Gtkwave deleted')
     gtkwave = reg['gearbox/gtkwave/inst']
     timekeep.timestep_changed.disconnect(gtkwave.update)
+    sim_bridge.traces_compacted.disconnect(gtkwave.traces_compacted)
+    node_activity = gtkwave.node_activity
+    node_activity.graph.node_expand_toggled.disconnect(node_activity.expand_toggled)
     for b in gtkwave.buffers:
         b.delete()
 
+    for intf in gtkwave.graph_intfs:
+        intf.close_index()
+
     reg['gearbox/gtkwave/inst'] = None
 
 
@@ -62,6 +75,7 @@ class GtkWave:
 
         timestep_event_register(self.update)
 
+        self.node_activity = NodeActivity()
         self.graph_intfs = []
         self.instances = []
         self.buffers = []
@@ -85,6 +99,8 @@ class GtkWave:
             trace_fn = vcd_trace_obj.shmid
         else:
             trace_fn = vcd_trace_obj.trace_fn
+            if os.path.isfile(fst_trace_fn(trace_fn)):
+                trace_fn = fst_trace_fn(trace_fn)
 
         window = GtkWaveWindow(trace_fn)
 
@@ -102,7 +118,8 @@ class GtkWave:
         sigs = [s.strip() for s in window.command('list_signals').split('\n')]
 
         vcd_map = vcd_map_cls(vcd_trace_obj.gear, sigs)
-        intf = GtkWaveGraphIntf(vcd_map, window)
+        intf = GtkWaveGraphIntf(vcd_map, window, self.node_activity,
+                                *self.create_vcd_index(window))
         self.graph_intfs.append(intf)
 
         buffer = GtkWaveBuffer(intf, window, f'gtkwave - {vcd_map.name}')
@@ -110,6 +127,26 @@ class GtkWave:
         self.instances.append(window)
         self.buffers.append(buffer)
 
+    def create_vcd_index(self, window):
+        if window.shmidcat or not reg['gearbox/gtkwave/vcd_index']:
+            return None, None
+
+        columnar_fn = columnar_trace_fn(window.trace_fn)
+        if os.path.isfile(columnar_fn):
+            return ColumnarTrace(columnar_fn), None
+
+        # Trace streamed through a FIFO can only be consumed by gtkwave
+        if not os.path.isfile(window.trace_fn):
+            return None, None
+
+        tailer = VCDTailer(window.trace_fn)
+        tailer.poll()
+        return tailer.index, tailer
+
+    def traces_compacted(self):
+        for intf in self.graph_intfs:
+            intf.load_compacted()
+
     def item_gtkwave_intf(self, item):
         for intf in self.graph_intfs:
             if intf.has_item_wave(item):
@@ -135,6 +172,13 @@ class GtkWave:
         for intf, pipes in intfs.items():
             intf.update_pipes(pipes)
 
+    def pipe_heat(self, metric, start, end):
+        heat = {}
+        for intf in self.graph_intfs:
+            heat.update(intf.pipe_heat(HEATMAP_METRICS[metric], start, end))
+
+        return heat
+
     def show_item(self, item):
         item_intf = self.item_gtkwave_intf(item)
         if item_intf is None:
@@ -150,6 +194,9 @@ class GtkWave:
         for w in self.graph_intfs:
             w.update(timestep)
 
+        if reg['gearbox/heatmap/metric'] is not None:
+            heatmap_update()
+
 
 class GtkWaveBuffer(Buffer):
     def __init__(self, intf, gtk_window, name):
@@ -178,13 +225,13 @@ class PipeActivityVisitor(HierYielderBase):
         self.vcd_map = vcd_map
 
     def PipeModel(self, node):
-        if node.view.isVisible():
+        if node.visible:
             yield node
 
         return True
 
     def NodeModel(self, node):
-        if node.view.collapsed:
+        if not node.expanded:
             return True
 
         if node not in self.vcd_map:
@@ -195,21 +242,67 @@ class PipeActivityVisitor(HierYielderBase):
         return True
 
 
+def node_activity(node, trans):
+    status = trans.status
+    if not (node.rtl.hierarchical or node.rtl in reg['sim/map'] or node.rtl in reg['hdlgen/map']):
+        trans.set_status(node, 'done')
+    elif (any(status(p) == 'active' for p in node.input_ext_pipes)
+          and (not any(status(p) == 'active' or status(p) == 'handshaked'
+                       for p in node.output_ext_pipes))):
+        trans.set_status(node, 'stuck')
+    else:
+        trans.set_status(node, 'empty')
+
+
 class NodeActivityVisitor(HierVisitorBase):
+    def __init__(self, trans):
+        self.trans = trans
+
     def NodeModel(self, node):
-        if not (node.rtl.hierarchical or node.rtl in reg['sim/map'] or node.rtl in reg['hdlgen/map']):
-            node.set_status('done')
-        elif (any(p.status == 'active' for p in node.input_ext_pipes)
-              and (not any(p.status == 'active' or p.status == 'handshaked'
-                             for p in node.output_ext_pipes))):
-            node.set_status('stuck')
-        else:
-            node.set_status('empty')
+        node_activity(node, self.trans)
 
-        if node.view.collapsed:
+        if not node.expanded:
             return True
 
 
+class NodeActivity:
+    """Keeps the node statuses in line with the statuses of their pipes.
+
+    The status of a node depends only on its external pipes, so after the
+    first full pass only the producers and consumers of the pipes whose
+    status changed are re-evaluated. The children of the newly expanded
+    nodes are re-evaluated as well, since they were not tracked while
+    hidden.
+    """
+
+    @inject
+    def __init__(self, graph=Inject('gearbox/graph')):
+        self.dirty = None
+        self.graph = graph
+        graph.node_expand_toggled.connect(self.expand_toggled)
+
+    def expand_toggled(self, expanded, model):
+        if expanded and self.dirty is not None:
+            self.dirty.update(c for c in model.child if isinstance(c, NodeModel))
+
+    @inject
+    def update(self, trans, top=Inject('gearbox/graph_model')):
+        if self.dirty is None:
+            NodeActivityVisitor(trans).visit(top)
+            self.dirty = set()
+            return
+
+        nodes = self.dirty
+        self.dirty = set()
+        for pipe in trans.changed():
+            if isinstance(pipe, PipeModel):
+                nodes.add(pipe.producer)
+                nodes.add(pipe.consumer)
+
+        for node in nodes:
+            node_activity(node, trans)
+
+
 def chunk_list(l, size=2048):
     chunks = []
     cur_chunk = []
@@ -231,9 +324,15 @@ def chunk_list(l, size=2048):
 class GtkWaveGraphIntf(QtCore.QObject):
     vcd_loaded = QtCore.Signal()
 
-    def __init__(self, vcd_map, gtkwave_intf):
+    def __init__(self, vcd_map, gtkwave_intf, node_activity, vcd_index=None, vcd_tailer=None):
         super().__init__()
         self.vcd_map = vcd_map
+        self.node_activity = node_activity
+        self.vcd_index = vcd_index
+        self.vcd_tailer = vcd_tailer
+        self.timelines = None
+        if vcd_index is not None:
+            self.timelines = HandshakeTimelines(vcd_index, vcd_map)
         self.graph = vcd_map.subgraph
         self.gtkwave_intf = gtkwave_intf
         # dbg_connect(self.gtkwave_intf.response, self.gtkwave_resp)
@@ -241,6 +340,7 @@ class GtkWaveGraphIntf(QtCore.QObject):
         self.items_on_wave = {}
         self.should_update = False
         self.updating = False
+        self.reload_pending = False
         self.timestep = 0
 
     def has_item_wave(self, item):
@@ -259,17 +359,18 @@ class GtkWaveGraphIntf(QtCore.QObject):
             print(f'No signals found for {node.name}')
             return
 
+        commands = []
         for i in range(0, len(sigs), 20):
             s = sigs[i:i + 20]
-            self.gtkwave_intf.command(
-                [f'gtkwave::addSignalsFromList {{{" ".join(s)}}}'])
+            commands.append(f'gtkwave::addSignalsFromList {{{" ".join(s)}}}')
 
         for i in range(0, len(sigs), 20):
             s = sigs[i:i + 20]
-            self.gtkwave_intf.command(
-                [f'gtkwave::highlightSignalsFromList {{{" ".join(s)}}}'])
+            commands.append(f'gtkwave::highlightSignalsFromList {{{" ".join(s)}}}')
+
+        commands.append(f'gtkwave::/Edit/Create_Group {node.name}')
 
-        self.gtkwave_intf.command([f'gtkwave::/Edit/Create_Group {node.name}'])
+        self.gtkwave_intf.batch(commands)
 
         self.items_on_wave[node] = node.name
 
@@ -341,11 +442,11 @@ class GtkWaveGraphIntf(QtCore.QObject):
         commands.append('select_trace_by_name {' + intf_name + '}')
         commands.append('gtkwave::/Edit/Toggle_Group_Open|Close')
 
-        self.gtkwave_intf.command(commands)
+        self.gtkwave_intf.batch(commands)
 
         return intf_name
 
-    def update_rtl_intf(self, pipe, wave_status):
+    def update_rtl_intf(self, pipe, wave_status, trans):
         done = get_source_producer(pipe.rtl).done
 
         if wave_status == '1 0':
@@ -359,7 +460,7 @@ class GtkWaveGraphIntf(QtCore.QObject):
         else:
             status = 'empty'
 
-        pipe.set_status(status)
+        trans.set_status(pipe, status)
 
     @property
     def cmd_id(self):
@@ -369,6 +470,13 @@ class GtkWaveGraphIntf(QtCore.QObject):
         if cmd_id != self.cmd_id:
             return
 
+        if self.vcd_index is not None:
+            self.updating = False
+            if self.reload_pending:
+                self.reload_gtkwave()
+
+            return
+
         if self.gtkwave_intf.shmidcat:
             ts = timestep()
             if ts is None:
@@ -383,7 +491,7 @@ class GtkWaveGraphIntf(QtCore.QObject):
 
             if not gtk_timestep or ts - self.timestep > reg['gearbox/refresh-rate']:
                 self.should_update = False
-                self.gtkwave_intf.command_nb(f'gtkwave::nop', self.cmd_id)
+                self.gtkwave_intf.command_nb(f'gtkwave::nop', self.cmd_id, key='reload')
                 # print("Again")
                 return
 
@@ -392,17 +500,18 @@ class GtkWaveGraphIntf(QtCore.QObject):
         # self.update_pipes(p for p in self.vcd_map.vcd_pipes if p.view.isVisible())
 
         if self.gtkwave_intf.shmidcat:
-            self.gtkwave_intf.command(
-                f'set_marker_if_needed {self.timestep*10}')
+            self.gtkwave_intf.command_nb(
+                f'set_marker_if_needed {self.timestep*10}', key='marker')
 
         if self.should_update:
             self.should_update = False
             # print(f'Updating immediatelly')
             if self.gtkwave_intf.shmidcat:
-                self.gtkwave_intf.command_nb(f'gtkwave::nop', self.cmd_id)
+                self.gtkwave_intf.command_nb(f'gtkwave::nop', self.cmd_id, key='reload')
             else:
                 self.gtkwave_intf.command_nb(f'gtkwave::reLoadFile',
-                                             self.cmd_id)
+                                             self.cmd_id,
+                                             key='reload')
 
         else:
             self.updating = False
@@ -413,30 +522,49 @@ class GtkWaveGraphIntf(QtCore.QObject):
 
         ts = self.vcd_map.timestep
 
-        signal_names = [(pipe, self.vcd_map.pipe_data_signal_stem(pipe)[:-4])
-                        for pipe in pipes if pipe.status[0] != ts]
+        pipes = [pipe for pipe in pipes if pipe.status[0] != ts]
 
-        for i in range(0, len(signal_names), 20):
+        with reg['gearbox/graph'].status_transaction() as trans:
+            if self.vcd_index is not None:
+                self.update_pipes_from_index(pipes, ts, trans)
+            else:
+                self.update_pipes_from_gtkwave(pipes, ts, trans)
 
-            cur_slice = slice(i, min(len(signal_names), i + 20))
-            cur_names = signal_names[cur_slice]
+            self.node_activity.update(trans)
 
-            ret = self.gtkwave_intf.command(
-                f'get_values {ts*10} [list {" ".join(s[1] for s in cur_names)}]'
-            )
+    def update_pipes_from_index(self, pipes, ts, trans):
+        for pipe, status in self.timelines.statuses(pipes, ts * 10):
+            if status == 'empty' and get_source_producer(pipe.rtl).done:
+                status = 'done'
 
-            if ret is None:
-                return
+            trans.set_status(pipe, status)
 
-            rtl_status = ret.split('\n')
+    def pipe_heat(self, code, start, end):
+        # Heatmap metrics can only be calculated from the indexed trace
+        if self.timelines is None:
+            return {}
 
-            if len(rtl_status) != (cur_slice.stop - cur_slice.start):
-                continue
+        pipes = PipeActivityVisitor(self.vcd_map).visit(self.vcd_map.model)
+        traced, occupancy = self.timelines.occupancy(pipes, start * 10, end * 10)
+
+        return dict(zip(traced, occupancy[:, code]))
+
+    def update_pipes_from_gtkwave(self, pipes, ts, trans):
+
+        signal_names = [(pipe, self.vcd_map.pipe_data_signal_stem(pipe)[:-4])
+                        for pipe in pipes]
+
+        results = self.gtkwave_intf.batch(
+            [f'get_values {ts*10} [list {stem}]' for _, stem in signal_names])
+
+        if results is None:
+            return
 
-            for wave_status, (pipe, _) in zip(rtl_status, cur_names):
-                self.update_rtl_intf(pipe, wave_status.strip())
+        for res, (pipe, _) in zip(results, signal_names):
+            if res is None or not res.ok:
+                continue
 
-        NodeActivityVisitor().visit(reg['gearbox/graph_model'])
+            self.update_rtl_intf(pipe, res.output.strip(), trans)
 
     @inject
     def update(self, timestep=Inject('gearbox/timestep')):
@@ -447,22 +575,63 @@ class GtkWaveGraphIntf(QtCore.QObject):
         #     f"Updating {self.vcd_map.name} from {self.timestep} to {timestep}, id: {self.cmd_id}"
         # )
 
-        if timestep < self.timestep:
+        if self.vcd_index is not None:
+            self.update_indexed(timestep)
+        elif timestep < self.timestep:
             self.update_pipes(
                 PipeActivityVisitor(self.vcd_map).visit(self.vcd_map.model))
             # self.update_pipes(p for p in self.vcd_map.vcd_pipes if p.view.isVisible())
-            self.gtkwave_intf.command(f'set_marker_if_needed {timestep*10}')
+            self.gtkwave_intf.command_nb(f'set_marker_if_needed {timestep*10}',
+                                         key='marker')
         elif not self.updating:
             self.should_update = False
             self.updating = True
             if self.gtkwave_intf.shmidcat:
-                self.gtkwave_intf.command_nb(f'gtkwave::nop', self.cmd_id)
+                self.gtkwave_intf.command_nb(f'gtkwave::nop', self.cmd_id, key='reload')
             else:
                 self.gtkwave_intf.command_nb(f'gtkwave::reLoadFile',
-                                             self.cmd_id)
+                                             self.cmd_id,
+                                             key='reload')
         else:
             self.should_update = True
 
+    def update_indexed(self, timestep):
+        # Graph status is read from the indexed trace, so gtkwave only needs to
+        # reload the file when something was appended to it
+        if self.vcd_tailer is not None and self.vcd_tailer.poll():
+            self.reload_pending = True
+
+        self.timestep = timestep
+        self.update_pipes(
+            PipeActivityVisitor(self.vcd_map).visit(self.vcd_map.model))
+
+        if self.reload_pending and not self.updating:
+            self.reload_gtkwave()
+
+        self.gtkwave_intf.command_nb(f'set_marker_if_needed {timestep*10}', key='marker')
+
+    def load_compacted(self):
+        if self.vcd_tailer is None:
+            return
+
+        columnar_fn = columnar_trace_fn(self.vcd_tailer.trace_fn)
+        if os.path.isfile(columnar_fn):
+            self.close_index()
+            self.vcd_index = ColumnarTrace(columnar_fn)
+            self.vcd_tailer = None
+            self.timelines = HandshakeTimelines(self.vcd_index, self.vcd_map)
+
+    def close_index(self):
+        if self.vcd_index is not None:
+            self.vcd_index.close()
+            self.vcd_index = None
+            self.timelines = None
+
+    def reload_gtkwave(self):
+        self.updating = True
+        self.reload_pending = False
+        self.gtkwave_intf.command_nb(f'gtkwave::reLoadFile', self.cmd_id, key='reload')
+
     def close(self):
         self.gtkwave_intf.close()
 
@@ -483,3 +652,11 @@ class GtkWaveBufferPlugin(LayoutPlugin):
         reg.confdef('gearbox/gtkwave/menus',
                     default=False,
                     setter=menu_visibility)
+
+        reg.confdef('gearbox/gtkwave/vcd_index', default=True)
+        reg.confdef('gearbox/gtkwave/cmd_timeout', default=30)
+        # Minimal time in ms between two queued commands sent to gtkwave
+        reg.confdef('gearbox/gtkwave/frame_budget', default=16)
+        # Show the command queue depth and the merged and dropped command
+        # counts in the modeline of the gtkwave buffers
+        reg.confdef('gearbox/gtkwave/cmd_stats', default=False)
@@ -184,3 +184,61 @@ proc set_marker_if_needed {timestep} {
         # gtkwave::setWindowStartTime [expr $timestep - 10]
     }
 }
+
+# Batched requests from gearbox
+#
+# The request is a flat list of id/command pairs. Commands are evaluated at
+# global level one after another, and whatever each of them prints, followed by
+# its result, is captured and sent back in a single framed response:
+#
+#   @@gbx <id> <catch status> <output with \, newline and CR escaped>
+#   ...
+#   @@gbx-end <number of commands>
+
+proc gearbox_capture_puts {args} {
+    set nonewline 0
+    if {[lindex $args 0] eq "-nonewline"} {
+        set nonewline 1
+        set args [lrange $args 1 end]
+    }
+
+    if {[llength $args] == 2} {
+        if {[lindex $args 0] ne "stdout"} {
+            if {$nonewline} {
+                return [gearbox_orig_puts -nonewline {*}$args]
+            }
+            return [gearbox_orig_puts {*}$args]
+        }
+        set args [lrange $args 1 end]
+    }
+
+    append ::gearbox_batch_out [lindex $args 0]
+    if {!$nonewline} {
+        append ::gearbox_batch_out "\n"
+    }
+}
+
+proc gearbox_batch {reqs} {
+    set resp {}
+
+    rename ::puts ::gearbox_orig_puts
+    rename ::gearbox_capture_puts ::puts
+
+    foreach {id cmd} $reqs {
+        set ::gearbox_batch_out ""
+        set status [catch {uplevel #0 $cmd} res]
+        if {$res ne ""} {
+            append ::gearbox_batch_out $res
+        }
+        lappend resp [list $id $status $::gearbox_batch_out]
+    }
+
+    rename ::puts ::gearbox_capture_puts
+    rename ::gearbox_orig_puts ::puts
+
+    foreach r $resp {
+        lassign $r id status out
+        puts "@@gbx $id $status [string map {\\ \\\\ \n \\n \r \\r} $out]"
+    }
+    puts "@@gbx-end [llength $resp]"
+}
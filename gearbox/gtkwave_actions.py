@@ -7,6 +7,7 @@ from .graph import GraphBufferPlugin
 from pygears.conf import Inject, inject_async, inject, MayInject, reg
 from .sim_actions import time_search, step_simulator, cont_simulator
 from .timestep_modeline import TimestepModeline
+from .cmd_queue_modeline import CmdQueueModeline
 
 
 @inject
@@ -95,3 +96,4 @@ class GtkwaveActionsPlugin(GraphBufferPlugin, GtkWaveBufferPlugin):
         reg['gearbox/plugins/graph']['GraphGtkwaveSelectSync'] = GraphGtkwaveSelectSync
 
         reg['gearbox/plugins/gtkwave']['TimestepModeline'] = TimestepModeline
+        reg['gearbox/plugins/gtkwave']['CmdQueueModeline'] = CmdQueueModeline
@@ -1,5 +1,7 @@
+import collections
 import os
 import re
+from typing import NamedTuple
 
 import Xlib
 import Xlib.display
@@ -9,6 +11,63 @@ from PySide2 import QtCore, QtGui, QtWidgets
 
 from pygears.conf import Inject, inject, reg
 
+BATCH_LINE = '@@gbx '
+BATCH_END = '@@gbx-end'
+EVENT_RE = re.compile(r"^\$\$(\w+):(.*)$")
+
+
+class BatchResult(NamedTuple):
+    status: int
+    output: str
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+
+def tcl_batch_request(cmds):
+    # Each command goes on its own line, since the pty in canonical mode
+    # accepts lines of at most MAX_CANON (4096) bytes. Tcl keeps reading the
+    # lines until the braces are closed.
+    return 'gearbox_batch {\n' + ''.join(f'{cmd_id} {{{cmd}}}\n' for cmd_id, cmd in cmds) + '}'
+
+
+def _batch_unescape(match):
+    return {'n': '\n', 'r': '\r'}.get(match.group(1), match.group(1))
+
+
+def parse_batch_response(data):
+    results = {}
+    for line in data.split('\n'):
+        # First line may start with what is left of the previous prompt
+        line = line.rstrip('\r').lstrip()
+        if not line.startswith(BATCH_LINE):
+            continue
+
+        _, cmd_id, status, *output = line.split(' ', 3)
+        output = re.sub(r'\\(.)', _batch_unescape, output[0] if output else '')
+        results[cmd_id] = BatchResult(int(status), output)
+
+    return results
+
+
+class LineFramer:
+    """Splits a stream of text read in arbitrary pieces into complete lines.
+
+    Text after the last newline is held back until the rest of its line
+    arrives with one of the next reads.
+    """
+
+    def __init__(self):
+        self.partial = ''
+
+    def feed(self, data):
+        *lines, self.partial = (self.partial + data).split('\n')
+        return [line.rstrip('\r') for line in lines]
+
+    def reset(self):
+        self.partial = ''
+
 
 class GtkEventProc(QtCore.QObject):
     def gtk_event(self, name, data):
@@ -74,6 +133,7 @@ class GtkWaveProc(QtCore.QObject):
 
     window_up = QtCore.Signal(str, int, int)
     response = QtCore.Signal(str, int)
+    batch_response = QtCore.Signal(object, int)
     gtk_event = QtCore.Signal(str, str)
 
     def __init__(self, trace_fn):
@@ -85,7 +145,9 @@ class GtkWaveProc(QtCore.QObject):
         self.moveToThread(self.thrd)
         self.exiting = False
         self.cmd_id = None
-        self.shmidcat = (os.path.splitext(self.trace_fn)[-1] != '.vcd')
+        self.notifier = None
+        self.framer = LineFramer()
+        self.shmidcat = (os.path.splitext(self.trace_fn)[-1] not in ('.vcd', '.fst'))
         self.thrd.started.connect(self.run)
         self.thrd.start()
 
@@ -99,7 +161,7 @@ class GtkWaveProc(QtCore.QObject):
             cmd = f'gtkwave -W -I -N -r {gtkwaverc_fn} -T {script_fn} {self.trace_fn}'
 
         else:
-            print(f'VCD file: {self.trace_fn}')
+            print(f'Trace file: {self.trace_fn}')
             cmd = f'gtkwave -W -N -r {gtkwaverc_fn} -T {script_fn} {self.trace_fn}'
 
         print(cmd)
@@ -127,45 +189,73 @@ class GtkWaveProc(QtCore.QObject):
         print(f'Window id: {window_id} -> {int(window_id)}')
         self.window_up.emit(version, self.p.pid, int(window_id))
 
-        while (1):
-            self.thrd.eventDispatcher().processEvents(QtCore.QEventLoop.AllEvents)
+        # From here on, the thread's event loop takes over. gtkwave output is
+        # read only when the pty signals that there is something to read,
+        # while the commands are served in between
+        self.notifier = QtCore.QSocketNotifier(self.p.child_fd, QtCore.QSocketNotifier.Read,
+                                               self)
+        self.notifier.activated.connect(self.read_events)
+        self.drain_buffer()
 
-            try:
-                data = ''
-                while True:
-                    data += self.p.read_nonblocking(size=4096, timeout=0.01)
+    def read_events(self):
+        data = ''
+        try:
+            while True:
+                data += self.p.read_nonblocking(size=4096, timeout=0)
+        except pexpect.TIMEOUT:
+            pass
+        except pexpect.EOF:
+            print(f'Gtkwave EOF')
+            self.notifier.setEnabled(False)
+            self.thrd.quit()
 
-            except pexpect.TIMEOUT:
-                pass
-            except pexpect.EOF:
-                print(f'Gtkwave EOF')
-                self.thrd.quit()
-                return
+        self.dispatch_events(data)
+
+    def dispatch_events(self, data):
+        for line in self.framer.feed(data):
+            res = EVENT_RE.search(line.lstrip('% '))
 
-            for d in data.strip().split('\n'):
-                res = re.search(r"^\$\$(\w+):(.*)$", d)
+            if res:
+                self.gtk_event.emit(res.group(1), res.group(2))
 
-                if res:
-                    self.gtk_event.emit(res.group(1), res.group(2))
-                    self.thrd.eventDispatcher().processEvents(QtCore.QEventLoop.AllEvents)
+    def drain_buffer(self):
+        # Data that pexpect read past the prompt while waiting for a command
+        # response will not trigger the notifier again
+        data = self.p.buffer
+        self.p.buffer = ''
+        self.dispatch_events(data)
+
+    def command_done(self, before):
+        # Events that gtkwave printed while the command was executing end up
+        # in the response, so dispatch them as if they were read separately
+        self.dispatch_events(before)
+        self.framer.reset()
+        self.drain_buffer()
 
     def command(self, cmd, cmd_id):
+        # Response is always emitted, since the command scheduler and the
+        # blocking commands wait for it
         if self.p.closed:
+            self.response.emit('', cmd_id)
             return
 
         self.cmd_id = cmd_id
         # print(f'GtkWave> {cmd_id}, {cmd}')
         self.p.send(cmd + '\n')
         try:
-            self.p.expect('%', timeout=None)
+            self.p.expect('%', timeout=reg['gearbox/gtkwave/cmd_timeout'])
         except pexpect.TIMEOUT:
             print("timeout")
             print(self.p.buffer)
+            self.response.emit('', cmd_id)
             return
         except pexpect.EOF:
             print(f'Gtkwave EOF')
+            self.response.emit('', cmd_id)
             return
 
+        self.command_done(self.p.before)
+
         resp = '\n'.join([d for d in self.p.before.strip().split('\n') if not d.startswith("$$")])
 
         # print(f'GtkWave: {self.p.before.strip()}')
@@ -173,6 +263,32 @@ class GtkWaveProc(QtCore.QObject):
         self.response.emit(resp, cmd_id)
         self.cmd_id = None
 
+    def batch(self, cmds, cmd_id):
+        if self.p.closed:
+            self.batch_response.emit(None, cmd_id)
+            return
+
+        self.cmd_id = cmd_id
+        timeout = reg['gearbox/gtkwave/cmd_timeout']
+        self.p.send(tcl_batch_request(cmds) + '\n')
+        try:
+            self.p.expect_exact(BATCH_END, timeout=timeout)
+            data = self.p.before
+            self.p.expect('%', timeout=timeout)
+            self.command_done(data + self.p.before)
+        except pexpect.TIMEOUT:
+            print(f"Batch of {len(cmds)} commands timed out")
+            print(self.p.buffer)
+            data = None
+        except pexpect.EOF:
+            print(f'Gtkwave EOF')
+            data = None
+
+        resp = None if data is None else parse_batch_response(data)
+
+        self.batch_response.emit(resp, cmd_id)
+        self.cmd_id = None
+
     def close(self):
         print("aboutToQuit gtkwave")
         # import signal
@@ -200,6 +316,14 @@ class GtkWaveCmdBlock(QtCore.QEventLoop):
         self.exec_()
         return getattr(self, 'resp', None)
 
+    def batch(self, cmds, gtk_wave):
+        self.cmd = cmds
+        gtk_wave.proc.batch_response.connect(self.response)
+        gtk_wave.send_batch.emit(cmds, self.cmd_id)
+        self.exec_()
+        gtk_wave.proc.batch_response.disconnect(self.response)
+        return getattr(self, 'resp', None)
+
     def response(self, resp, cmd_id):
         if cmd_id == self.cmd_id:
             self.resp = resp
@@ -232,9 +356,86 @@ native_key_map = {
 }
 
 
+class GtkWaveCmdScheduler(QtCore.QObject):
+    """Paces the non-blocking commands sent to a gtkwave process.
+
+    Only one command is in flight at a time and commands are sent at most once
+    per frame budget. While waiting, a queued command is superseded by a newer
+    one submitted under the same key, so that a burst of marker moves or
+    reloads reaches gtkwave as a single command.
+
+    Queue depth and the counts of the sent, merged and dropped commands are
+    emitted through stats_changed whenever they change.
+    """
+
+    stats_changed = QtCore.Signal(object)
+
+    def __init__(self, send, response):
+        super().__init__()
+        self.send = send
+        self.queue = collections.OrderedDict()
+        self.in_flight = collections.deque()
+        self.last_sent = QtCore.QElapsedTimer()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+        response.connect(self.response)
+
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+
+    @property
+    def stats(self):
+        return {
+            'depth': len(self.queue),
+            'in_flight': len(self.in_flight),
+            'sent': self.sent,
+            'merged': self.merged,
+            'dropped': self.dropped
+        }
+
+    def submit(self, cmd, cmd_id=0, key=None):
+        if key is None:
+            key = object()
+        elif key in self.queue:
+            if self.queue[key] == (cmd, cmd_id):
+                self.dropped += 1
+            else:
+                self.merged += 1
+
+        self.queue[key] = (cmd, cmd_id)
+        self.stats_changed.emit(self.stats)
+        self.flush()
+
+    def response(self, resp, cmd_id):
+        if self.in_flight and self.in_flight[0] == cmd_id:
+            self.in_flight.popleft()
+            self.stats_changed.emit(self.stats)
+            self.flush()
+
+    def flush(self):
+        if not self.queue or self.in_flight or self.timer.isActive():
+            return
+
+        if self.last_sent.isValid():
+            remaining = reg['gearbox/gtkwave/frame_budget'] - self.last_sent.elapsed()
+            if remaining > 0:
+                self.timer.start(remaining)
+                return
+
+        _, (cmd, cmd_id) = self.queue.popitem(last=False)
+        self.in_flight.append(cmd_id)
+        self.last_sent.start()
+        self.sent += 1
+        self.stats_changed.emit(self.stats)
+        self.send(cmd, cmd_id)
+
+
 # class GtkWaveWindow(QtCore.QObject):
 class GtkWaveWindow(QtWidgets.QFrame):
     send_command = QtCore.Signal(str, int)
+    send_batch = QtCore.Signal(object, int)
     initialized = QtCore.Signal()
     deleted = QtCore.Signal()
 
@@ -247,14 +448,25 @@ class GtkWaveWindow(QtWidgets.QFrame):
         self.proc.gtk_event.connect(self.event_proc.gtk_event)
         self.proc.window_up.connect(self.window_up)
         self.send_command.connect(self.proc.command)
+        self.send_batch.connect(self.proc.batch)
         self.response = self.proc.response
+        self.scheduler = GtkWaveCmdScheduler(self.send_command.emit, self.proc.response)
 
     @property
     def shmidcat(self):
         return self.proc.shmidcat
 
-    def command_nb(self, cmd, cmd_id=0):
-        self.send_command.emit(cmd, cmd_id)
+    @property
+    def trace_fn(self):
+        return self.proc.trace_fn
+
+    def command_nb(self, cmd, cmd_id=0, key=None):
+        """Queues a command without waiting for the response.
+
+        A command still waiting in the queue is superseded by the next one
+        submitted with the same key.
+        """
+        self.scheduler.submit(cmd, cmd_id, key)
 
     def command(self, cmd):
         if isinstance(cmd, list):
@@ -270,6 +482,33 @@ class GtkWaveWindow(QtWidgets.QFrame):
         resp = cmd_block.command(cmd, self)
         return resp
 
+    def batch(self, cmds):
+        """Sends a batch of commands to gtkwave in a single round trip.
+
+        Commands are given either as a list, or as a dict with arbitrary keys.
+        Result of each command is returned as a BatchResult in the same form,
+        or None is returned if gtkwave did not respond.
+        """
+        if isinstance(cmds, dict):
+            keys = list(cmds.keys())
+            cmds = list(cmds.values())
+        else:
+            keys = None
+            cmds = list(cmds)
+
+        if not cmds:
+            return [] if keys is None else {}
+
+        resp = GtkWaveCmdBlock().batch(list(enumerate(cmds)), self)
+        if resp is None:
+            return None
+
+        results = [resp.get(str(i), None) for i in range(len(cmds))]
+        if keys is None:
+            return results
+
+        return dict(zip(keys, results))
+
     def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
         super().resizeEvent(event)
         self.win.configure(x=0, y=0, width=self.width(), height=self.height())
@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 from .node_model import find_cosim_modules, PipeModel, NodeModel
 from pygears import reg, find
 from pygears.hdl import hdlgen
@@ -7,60 +9,150 @@ from pygears.typing import Tuple, Union, Queue, Array, typeof
 from .timekeep import timestep
 
 
-def get_item_signals(subgraph, signals, prefix=''):
-    item_signals = {}
-    item = subgraph
-    item_path = []
-    lp = len(prefix)
+# Stems of the signals that Verilator generates for a DTI interface
+INTF_STEMS = ('data', 'valid', 'ready')
+
 
-    def find_child(parent, name):
-        # Try name as submodule
-        if name in parent:
-            return parent[name]
+class SignalTrieNode:
+    __slots__ = ('children', 'signals', '_names')
 
-        # Try name as interface name
-        intf_name = p.rpartition('_')[0]
+    def __init__(self):
+        self.children = {}
+        self.signals = []
+        self._names = None
 
-        if intf_name in parent:
-            return parent[intf_name]
+    @property
+    def names(self):
+        # Sorted child names, so that children sharing a prefix form a range
+        if self._names is None:
+            self._names = sorted(self.children)
 
-        return None
+        return self._names
 
-    for name in signals:
-        if prefix and not name.startswith(prefix):
-            continue
+    def subtree(self):
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            yield from node.signals
+            nodes.extend(reversed(list(node.children.values())))
 
-        if prefix:
-            name = name[lp:]
 
-        item = subgraph
-        path = name.split('.')
+class SignalTrie:
+    """Prefix trie of the signal names, split on hierarchy separators.
 
-        new_item_path = []
+    Built once per trace, it gives the signals under any hierarchical path by
+    walking only the components of that path.
+    """
 
-        import itertools
-        # for p, prev_item in itertools.zip_longest(path[1:], item_path):
-        for p, prev_item in itertools.zip_longest(path, item_path):
-            if prev_item and p == prev_item.basename:
-                item = prev_item
-            else:
-                child_item = find_child(item, p)
-                if child_item is None:
-                    break
+    def __init__(self, signals, prefix=''):
+        self.root = SignalTrieNode()
+        lp = len(prefix)
+
+        for name in signals:
+            if prefix and not name.startswith(prefix):
+                continue
+
+            if prefix:
+                name = name[lp:]
+
+            node = self.root
+            for p in name.split('.'):
+                child = node.children.get(p, None)
+                if child is None:
+                    child = node.children[p] = SignalTrieNode()
+
+                node = child
+
+            node.signals.append(name)
+
+    def find(self, path):
+        node = self.root
+        if not path:
+            return node
+
+        for p in path.split('.'):
+            node = node.children.get(p, None)
+            if node is None:
+                return None
 
-                item = child_item
+        return node
 
-            new_item_path.append(item)
+    def subtree_signals(self, path):
+        """Returns signals strictly below the path."""
+        node = self.find(path)
+        if node is None:
+            return []
 
-            if not item.hierarchical:
+        return [s for child in node.children.values() for s in child.subtree()]
+
+    def stem_signals(self, path, stems=INTF_STEMS):
+        """Returns signals named as the path with one of the stems appended after
+        an underscore, together with the signals below them."""
+
+        parent_path, _, name = path.rpartition('.')
+        node = self.find(parent_path)
+        if node is None:
+            return []
+
+        prefix = name + '_'
+        names = node.names
+        sigs = []
+        for i in range(bisect_left(names, prefix), len(names)):
+            child_name = names[i]
+            if not child_name.startswith(prefix):
                 break
 
-        item_path = new_item_path
+            if child_name[len(prefix):].startswith(stems):
+                sigs.extend(node.children[child_name].subtree())
+
+        return sigs
+
+
+def find_child(parent, name):
+    # Try name as submodule
+    if name in parent:
+        return parent[name]
+
+    # Try name as interface name
+    intf_name = name.rpartition('_')[0]
+
+    if intf_name in parent:
+        return parent[intf_name]
+
+    return None
+
+
+def get_item_signals(subgraph, trie):
+    """Maps the hierarchy items to the signals that belong to them.
+
+    Signal belongs to the deepest item found along its path. Each path
+    component is resolved against the hierarchy only once for all the signals
+    that share it.
+    """
 
+    item_signals = {}
+
+    def add(item, sigs):
         if item not in item_signals:
             item_signals[item] = []
 
-        item_signals[item].append(name)
+        item_signals[item].extend(sigs)
+
+    nodes = [(trie.root, subgraph)]
+    while nodes:
+        node, item = nodes.pop()
+
+        if node.signals:
+            add(item, node.signals)
+
+        for name, child in node.children.items():
+            child_item = find_child(item, name)
+            if child_item is None:
+                add(item, child.subtree())
+            elif not child_item.hierarchical:
+                add(child_item, child.subtree())
+            else:
+                nodes.append((child, child_item))
 
     return item_signals
 
@@ -70,12 +162,14 @@ class VCDMap:
         self.module = module
         self.model = reg['gearbox/graph_model_map'][module]
         self.sigs = sigs
+        self.trie = SignalTrie(sigs, self.path_prefix)
         if module.parent is None:
-            self.sigmap = get_item_signals(find('/'), sigs, self.path_prefix)
+            self.sigmap = get_item_signals(find('/'), self.trie)
         else:
-            self.sigmap = get_item_signals(module.parent, sigs, self.path_prefix)
+            self.sigmap = get_item_signals(module.parent, self.trie)
 
         self.item_signals = {}
+        self.type_groups = {}
 
     @property
     @inject
@@ -144,8 +238,12 @@ class VerilatorVCDMap(VCDMap):
         return '.'.join(reversed(path))
 
     def get_pipe_groups(self, item):
-        sigs = self[item]
-        return get_type_groups(sigs, item.rtl.dtype, [self.pipe_data_signal_stem(item)])
+        key = (item, item.rtl.dtype)
+        if key not in self.type_groups:
+            self.type_groups[key] = get_type_groups(self[item], item.rtl.dtype,
+                                                    [self.pipe_data_signal_stem(item)])
+
+        return self.type_groups[key]
 
     def __getitem__(self, item):
         if item not in self.item_signals:
@@ -154,12 +252,11 @@ class VerilatorVCDMap(VCDMap):
                     raise KeyError
 
                 parent_node = item.rtl.parent
+                if parent_node not in self.sigmap:
+                    raise KeyError
 
                 basename = self.item_basename(item)
-                sigs = [
-                    f'{self.path_prefix}{s}' for s in self.sigmap[parent_node]
-                    if s.startswith(basename)
-                ]
+                sigs = [f'{self.path_prefix}{s}' for s in self.trie.stem_signals(basename)]
                 self.item_signals[item] = sigs
             else:
                 self.item_signals[item] = [f'{self.path_prefix}{s}' for s in self.sigmap[item.rtl]]
@@ -178,7 +275,31 @@ class VerilatorVCDMap(VCDMap):
         return self.module.has_descendent(rtl)
 
 
+class SortedSignals:
+    """Sorted signal list, where signals of a field are found by bisection."""
+
+    def __init__(self, sigs):
+        self.sigs = sorted(sigs)
+
+    def select(self, name):
+        # Field signal is either named exactly as the field, or has the bit
+        # range appended, which puts it between name + '[' and name + '\\'
+        sigs = self.sigs
+        sel = []
+
+        i = bisect_left(sigs, name)
+        if i < len(sigs) and sigs[i] == name:
+            sel.append(name)
+
+        sel.extend(sigs[bisect_left(sigs, name + '['):bisect_left(sigs, name + '\\')])
+
+        return sel
+
+
 def get_type_groups(sigs, t, path):
+    if not isinstance(sigs, SortedSignals):
+        sigs = SortedSignals(sigs)
+
     if typeof(t, Array):
         group = {}
         for i in range(len(t)):
@@ -189,13 +310,7 @@ def get_type_groups(sigs, t, path):
         return group
 
     if not typeof(t, (Tuple, Union, Queue)):
-        name = '.'.join(path)
-        sel = []
-        for s in sigs:
-            if s.startswith(name) and (len(s) == len(name) or s[len(name)] == '['):
-                sel.append(s)
-
-        return sel
+        return sigs.select('.'.join(path))
 
     group = {}
     for name in t.fields:
@@ -224,8 +339,12 @@ class PyGearsVCDMap(VCDMap):
         return item_name_stem.replace('/', '.')
 
     def get_pipe_groups(self, item):
-        sigs = self[item]
-        return get_type_groups(sigs, item.rtl.dtype, [self.item_basename(item), 'data'])
+        key = (item, item.rtl.dtype)
+        if key not in self.type_groups:
+            self.type_groups[key] = get_type_groups(self[item], item.rtl.dtype,
+                                                    [self.item_basename(item), 'data'])
+
+        return self.type_groups[key]
 
     def __getitem__(self, item):
         if item.rtl in reg[f'hdlgen/map']:
@@ -240,12 +359,7 @@ class PyGearsVCDMap(VCDMap):
                     raise KeyError
 
                 basename = self.item_basename(item)
-                sigs = []
-                for s in self.sigmap[prod_gear]:
-                    if s.startswith(basename) and s[len(basename)] == '.':
-                        sigs.append(s)
-
-                self.item_signals[item] = sigs
+                self.item_signals[item] = self.trie.subtree_signals(basename)
             else:
                 raise KeyError
 
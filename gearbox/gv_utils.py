@@ -1,3 +1,6 @@
+from functools import lru_cache
+
+
 def create_row(in_id, out_id, height, width):
     row_template = """
 <tr>
@@ -14,20 +17,27 @@ def create_row(in_id, out_id, height, width):
 
 
 def sort_perm(l):
-    sort_l = sorted(l, key=lambda x: x.y())
-    perm_l = sorted(range(len(l)), key=lambda x: l[x].y())
+    sort_l = sorted(l)
+    perm_l = sorted(range(len(l)), key=lambda x: l[x])
 
     return sort_l, perm_l
 
 
-def get_node_record(node):
+@lru_cache(maxsize=4096)
+def record_label(width, height, inputs, outputs):
+    """HTML table label for dot, with a row for each of the ports placed at
+    the given offsets from the top of the node.
+
+    Nodes of the same shape share the label, so it is built only once.
+    """
+
     label_template = """
 <<table border="0" cellspacing="0" cellborder="1">
 {}
 </table>>"""
 
-    input_ports, input_indices = sort_perm(node.inputs)
-    output_ports, output_indices = sort_perm(node.outputs)
+    input_ports, input_indices = sort_perm(inputs)
+    output_ports, output_indices = sort_perm(outputs)
     rows = []
 
     iin = 0
@@ -38,38 +48,38 @@ def get_node_record(node):
     while True:
 
         try:
-            pin = input_ports[iin].y() + input_ports[iin]._height/2
+            pin = input_ports[iin]
         except IndexError:
             pin = None
 
         try:
-            pout = output_ports[iout].y() + output_ports[iin]._height/2
+            pout = output_ports[iout]
         except IndexError:
             pout = None
 
         if pin is None and pout is None:
             rows.append(
-                create_row(None, None, node.height - cur_h, node.width))
+                create_row(None, None, height - cur_h, width))
             break
 
         if pout is None or (pin is not None and pin < pout):
-            rows.append(create_row(None, None, pin - cur_h, node.width))
+            rows.append(create_row(None, None, pin - cur_h, width))
 
-            rows.append(create_row(input_indices[iin], None, 1, node.width))
+            rows.append(create_row(input_indices[iin], None, 1, width))
             cur_h = pin + 1
             iin += 1
         elif pin is None or pout < pin:
-            rows.append(create_row(None, None, pout - cur_h, node.width))
-            rows.append(create_row(None, output_indices[iout], 1, node.width))
+            rows.append(create_row(None, None, pout - cur_h, width))
+            rows.append(create_row(None, output_indices[iout], 1, width))
             cur_h = pout + 1
             iout += 1
         else:
-            rows.append(create_row(None, None, pout - cur_h, node.width))
+            rows.append(create_row(None, None, pout - cur_h, width))
             rows.append(
                 create_row(input_indices[iin], output_indices[iout], 1,
-                           node.width))
+                           width))
             cur_h = pout + 1
             iin += 1
             iout += 1
 
-    return label_template.format('\n'.join(rows))
+    return label_template.format('\n'.join(rows)).replace('\n', '')
@@ -0,0 +1,314 @@
+import numpy as np
+
+# Handshake state of an interface is encoded as valid*2 + ready
+STATUS_NAMES = np.array(['empty', 'waited', 'active', 'handshaked'], dtype=object)
+
+
+def reserve(buf, size):
+    if len(buf) >= size:
+        return buf
+
+    grown = np.zeros((max(size, 2 * len(buf)), ) + buf.shape[1:], dtype=buf.dtype)
+    grown[:len(buf)] = buf
+    return grown
+
+
+def sample(times, bits, at):
+    if not len(bits):
+        return np.zeros(len(at), dtype=np.int8)
+
+    i = np.searchsorted(times, at, side='right') - 1
+    return np.where(i >= 0, bits[np.maximum(i, 0)], 0)
+
+
+class SignalBits:
+    """Change times and values of a single bit signal, converted to arrays as
+    the trace grows."""
+
+    def __init__(self, sig):
+        self.sig = sig
+        self.revision = None
+        self.size = 0
+        self._times = np.zeros(0, dtype=np.int64)
+        self._bits = np.zeros(0, dtype=np.int8)
+
+    @property
+    def times(self):
+        return self._times[:self.size]
+
+    @property
+    def bits(self):
+        return self._bits[:self.size]
+
+    def refresh(self):
+        """Converts the changes appended since the last refresh and returns
+        the time of the first converted change that differs from before, or
+        None if there is none."""
+
+        sig = self.sig
+        if sig.revision == self.revision:
+            return None
+
+        self.revision = sig.revision
+
+        # Last change might have been overwritten in place, so it is redone
+        start = max(self.size - 1, 0)
+        size = len(sig.times)
+        last = self._bits[start] if self.size else None
+
+        self._times = reserve(self._times, size)
+        self._bits = reserve(self._bits, size)
+        self._times[start:size] = sig.times[start:size]
+        values = sig.values
+        self._bits[start:size] = [values[i] == '1' for i in range(start, size)]
+
+        first = start
+        if self.size and self._bits[start] == last:
+            first = self.size
+
+        self.size = size
+
+        return self._times[first] if first < size else None
+
+
+class HandshakeTimeline:
+    """Sorted change times of a DTI interface with its handshake state after
+    each change, and the prefix sums of the time spent in each state up to
+    each change.
+
+    Changes can only be appended to the trace, or overwrite the value at the
+    last time, so on refresh only the rows from the earliest changed value
+    onwards are recalculated.
+    """
+
+    def __init__(self, valid, ready):
+        self.valid = SignalBits(valid)
+        self.ready = SignalBits(ready)
+        self.size = 0
+        self._times = np.zeros(0, dtype=np.int64)
+        self._codes = np.zeros(0, dtype=np.int8)
+        self._cum = np.zeros((0, len(STATUS_NAMES)), dtype=np.int64)
+
+    @property
+    def times(self):
+        return self._times[:self.size]
+
+    @property
+    def codes(self):
+        return self._codes[:self.size]
+
+    @property
+    def cum(self):
+        return self._cum[:self.size]
+
+    def refresh(self):
+        """Returns the number of the recalculated rows."""
+
+        changed = [t for t in (self.valid.refresh(), self.ready.refresh()) if t is not None]
+        if not changed:
+            return 0
+
+        # Changes come in time order, so the rows before the earliest changed
+        # value stay the same
+        since = min(changed)
+        start = np.searchsorted(self.times, since)
+
+        valid_times, valid_bits = self.valid.times, self.valid.bits
+        ready_times, ready_bits = self.ready.times, self.ready.bits
+        times = np.union1d(valid_times[np.searchsorted(valid_times, since):],
+                           ready_times[np.searchsorted(ready_times, since):])
+        codes = (2 * sample(valid_times, valid_bits, times) +
+                 sample(ready_times, ready_bits, times)).astype(np.int8)
+
+        size = start + len(times)
+        self._times = reserve(self._times, size)
+        self._codes = reserve(self._codes, size)
+        self._cum = reserve(self._cum, size)
+        self._times[start:size] = times
+        self._codes[start:size] = codes
+
+        # Prefix sums continue from the last row that was kept
+        rows = np.arange(max(start, 1), size)
+        durations = np.zeros((size - start, len(STATUS_NAMES)), dtype=np.int64)
+        durations[rows - start, self._codes[rows - 1]] = self._times[rows] - self._times[rows - 1]
+        if start:
+            durations[0] += self._cum[start - 1]
+
+        np.cumsum(durations, axis=0, out=self._cum[start:size])
+        self.size = size
+
+        return size - start
+
+    def position(self, time):
+        return np.searchsorted(self.times, time, side='right') - 1
+
+    def code_at(self, time):
+        pos = self.position(time)
+        return self._codes[pos] if pos >= 0 else 0
+
+    def time_in_states(self, time):
+        pos = self.position(time)
+        if pos < 0:
+            return np.zeros(len(STATUS_NAMES), dtype=np.int64)
+
+        acc = self._cum[pos].copy()
+        acc[self._codes[pos]] += time - self._times[pos]
+        return acc
+
+
+class HandshakeTimelines:
+    """Handshake timelines of all traced pipes, flattened for batch lookup.
+
+    Timelines of the pipes are concatenated into a single array, where change
+    times of each pipe are shifted by its slot times the trace span. Hence the
+    status of any number of pipes at a given time is found with a single
+    vectorized binary search.
+
+    While the trace grows, the timelines that changed since the arrays were
+    last flattened are looked up one by one instead. Arrays are flattened
+    again once the trace stops growing, or once the changes outgrow them, so
+    that the refresh cost stays proportional to the new data.
+    """
+
+    def __init__(self, index, vcd_map):
+        self.index = index
+        self.vcd_map = vcd_map
+        self.clear()
+
+    def clear(self):
+        self.signals = self.index.signals
+        self.timelines = {}
+        self.pipes = []
+        self.slots = {}
+        self.dirty = set()
+        self.pending = 0
+        self.flatten()
+
+    def timeline(self, pipe):
+        if pipe not in self.timelines:
+            try:
+                valid_sig, ready_sig = self.vcd_map.pipe_handshake_signals(pipe)
+                timeline = HandshakeTimeline(self.index.signal(valid_sig),
+                                             self.index.signal(ready_sig))
+            except KeyError:
+                timeline = None
+
+            self.timelines[pipe] = timeline
+            if timeline is not None:
+                self.slots[pipe] = len(self.pipes)
+                self.pipes.append(pipe)
+                self.dirty.add(pipe)
+
+        return self.timelines[pipe]
+
+    def refresh(self):
+        grown = False
+        for pipe in self.pipes:
+            rows = self.timelines[pipe].refresh()
+            if rows:
+                grown = True
+                self.pending += rows
+                self.dirty.add(pipe)
+
+        if self.dirty and (not grown or self.pending > len(self.keys)):
+            self.flatten()
+
+    def flatten(self):
+        timelines = [self.timelines[p] for p in self.pipes]
+        lengths = [len(t.times) for t in timelines]
+
+        self.starts = np.zeros(len(timelines) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.starts[1:])
+
+        self.span = 1 + max((int(t.times[-1]) for t in timelines if len(t.times)), default=0)
+
+        if timelines:
+            self.keys = np.concatenate(
+                [t.times + slot * self.span for slot, t in enumerate(timelines)])
+            self.times = np.concatenate([t.times for t in timelines])
+            self.codes = np.concatenate([t.codes for t in timelines])
+            self.cum = np.concatenate([t.cum for t in timelines])
+        else:
+            self.keys = np.zeros(0, dtype=np.int64)
+            self.times = np.zeros(0, dtype=np.int64)
+            self.codes = np.zeros(0, dtype=np.int8)
+            self.cum = np.zeros((0, len(STATUS_NAMES)), dtype=np.int64)
+
+        self.dirty.clear()
+        self.pending = 0
+
+    def traced(self, pipes):
+        if self.index.signals is not self.signals:
+            # Trace was restarted and the index rebuilt
+            self.clear()
+
+        traced = [p for p in pipes if self.timeline(p) is not None]
+        if traced:
+            self.refresh()
+
+        return traced
+
+    def positions(self, traced, time):
+        slots = np.fromiter((self.slots[p] for p in traced), dtype=np.int64, count=len(traced))
+
+        # Past the last change, the pipes keep their final state
+        key = slots * self.span + min(time, self.span - 1)
+        pos = np.searchsorted(self.keys, key, side='right') - 1
+
+        return pos, pos >= self.starts[slots]
+
+    def changed(self, traced):
+        return [(i, self.timelines[p]) for i, p in enumerate(traced) if p in self.dirty]
+
+    def statuses(self, pipes, time):
+        """Returns (pipe, status) pairs for the traced pipes among the given ones.
+
+        Status is one of 'active', 'waited', 'handshaked' or 'empty', where the
+        last one means that neither valid nor ready is raised.
+        """
+        traced = self.traced(pipes)
+        if not traced:
+            return []
+
+        if len(self.keys):
+            pos, changed = self.positions(traced, time)
+            codes = np.where(changed, self.codes[np.maximum(pos, 0)], 0)
+        else:
+            codes = np.zeros(len(traced), dtype=np.int8)
+
+        for i, timeline in self.changed(traced):
+            codes[i] = timeline.code_at(time)
+
+        return list(zip(traced, STATUS_NAMES[codes]))
+
+    def time_in_states(self, traced, time):
+        # Time that each pipe spent in each of the handshake states up to the
+        # given time, read from the prefix sums at the preceding change
+        if len(self.keys):
+            pos, changed = self.positions(traced, time)
+            pos = np.maximum(pos, 0)
+
+            acc = self.cum[pos].copy()
+            rows = np.arange(len(traced))
+            acc[rows, self.codes[pos]] += time - self.times[pos]
+            acc[~changed] = 0
+        else:
+            acc = np.zeros((len(traced), len(STATUS_NAMES)), dtype=np.int64)
+
+        for i, timeline in self.changed(traced):
+            acc[i] = timeline.time_in_states(time)
+
+        return acc
+
+    def occupancy(self, pipes, start, end):
+        """Returns the traced pipes among the given ones, together with the
+        fraction of the [start, end) time window that each of them spent in
+        each of the handshake states, indexed by the state code.
+        """
+        traced = self.traced(pipes)
+        if not traced or end <= start:
+            return traced, np.zeros((len(traced), len(STATUS_NAMES)))
+
+        acc = self.time_in_states(traced, end) - self.time_in_states(traced, start)
+
+        return traced, acc / (end - start)
@@ -0,0 +1,94 @@
+from pygears.conf import Inject, MayInject, PluginBase, inject, reg
+from pygears.core.hier_node import HierVisitorBase
+
+# Heatmap metrics, mapped to the handshake state code whose share of the time
+# window they measure
+HEATMAP_METRICS = {
+    # Handshakes per cycle
+    'throughput': 3,
+    # Consumer ready, but no data offered
+    'waited': 1,
+    # Data offered, but consumer not ready
+    'stalled': 2,
+}
+
+HEAT_COLOR_STOPS = [(0x32, 0x5a, 0xa0), (0xc8, 0xaa, 0x32), (0xb4, 0x32, 0x5a)]
+
+
+def heat_color(heat):
+    heat = min(max(heat, 0.0), 1.0) * (len(HEAT_COLOR_STOPS) - 1)
+    i = min(int(heat), len(HEAT_COLOR_STOPS) - 2)
+    frac = heat - i
+
+    rgb = (round(lo + (hi - lo) * frac)
+           for lo, hi in zip(HEAT_COLOR_STOPS[i], HEAT_COLOR_STOPS[i + 1]))
+
+    return '#' + ''.join(f'{c:02x}' for c in rgb)
+
+
+class HeatmapVisitor(HierVisitorBase):
+    def __init__(self, heat):
+        self.heat = heat
+
+    def PipeModel(self, pipe):
+        pipe.set_heat(self.heat.get(pipe, None))
+        return True
+
+    def NodeModel(self, node):
+        if self.heat is None:
+            node.set_heat(None)
+        else:
+            values = [
+                self.heat[p] for p in node.input_ext_pipes + node.output_ext_pipes
+                if p in self.heat
+            ]
+
+            node.set_heat(sum(values) / len(values) if values else None)
+
+        if not node.expanded:
+            return True
+
+
+class HeatmapClearVisitor(HeatmapVisitor):
+    def __init__(self):
+        super().__init__(None)
+
+    def PipeModel(self, pipe):
+        pipe.set_heat(None)
+        return True
+
+
+@inject
+def heatmap_update(metric=Inject('gearbox/heatmap/metric'),
+                   window=Inject('gearbox/heatmap/window'),
+                   gtkwave=MayInject('gearbox/gtkwave/inst'),
+                   graph_model=MayInject('gearbox/graph_model'),
+                   timestep=MayInject('gearbox/timestep')):
+    """Recolours the graph by the selected metric, aggregated over the window
+    of cycles that ends at the current timestep."""
+
+    if graph_model is None:
+        return
+
+    if metric is None or gtkwave is None:
+        HeatmapClearVisitor().visit(graph_model)
+        return
+
+    end = (timestep or 0) + 1
+    heat = gtkwave.pipe_heat(metric, max(0, end - window), end)
+
+    HeatmapVisitor(heat).visit(graph_model)
+
+
+class HeatmapPlugin(PluginBase):
+    @classmethod
+    def bind(cls):
+        # Length of the time window in cycles, ending at the current timestep
+        reg.confdef('gearbox/heatmap/window',
+                    default=1000,
+                    setter=lambda var, window: heatmap_update(window=window))
+
+        # One of the HEATMAP_METRICS, or None to show the simulation status
+        reg.confdef('gearbox/heatmap/metric',
+                    default=None,
+                    setter=lambda var, metric: heatmap_update(metric=metric))
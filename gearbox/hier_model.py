@@ -0,0 +1,60 @@
+class HierNode:
+    """Slot based counterpart of the pygears NamedHierNode for the graph models.
+
+    Instances carry no per-instance dict, which makes a difference for the
+    designs with many thousands of gears and interfaces. It is named after
+    the pygears class, since the pygears hierarchy visitors dispatch on the
+    class names and recurse into the children of a HierNode.
+    """
+
+    __slots__ = ('parent', 'child')
+
+    def __init__(self, parent=None):
+        self.child = []
+        self.parent = parent
+        if parent is not None:
+            parent.child.append(self)
+
+    def clear(self):
+        """Breaks the references within the subtree, so that it is freed as
+        soon as the outside references to it are dropped."""
+
+        for c in self.child:
+            c.clear()
+
+        self.child = []
+        self.parent = None
+
+    def root(self):
+        node = self
+        while node.parent is not None:
+            node = node.parent
+
+        return node
+
+    def __contains__(self, path):
+        try:
+            self[path]
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, path):
+        if not path:
+            raise KeyError(path)
+
+        if path[0] == '/':
+            return self.root()[path[1:]]
+
+        part, multi, rest = path.partition('/')
+
+        for child in self.child:
+            if child.basename == part:
+                break
+        else:
+            raise KeyError(path)
+
+        if not multi:
+            return child
+        else:
+            return child[rest]
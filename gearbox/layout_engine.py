@@ -0,0 +1,154 @@
+# Layout engines, which also run in the pre-layout worker processes started
+# as "python -m gearbox.layout_engine". To keep the workers small, this module
+# must not import the GUI, pygears or anything else from gearbox beyond the
+# engines themselves.
+
+import json
+import subprocess
+import sys
+
+import numpy as np
+import pygraphviz as pgv
+
+from .gv_utils import record_label
+from .sugiyama import run_sugiyama
+
+
+def plain_load(plain, desc):
+    """Reads the geometry out of the dot's plain-ext output.
+
+    Plain output lists the nodes and the edges with their coordinates as
+    numbers, so unlike the 'pos' attributes they need no per-point parsing.
+    Edges are listed with their ports, which identifies them up to the
+    interchangeable parallel edges.
+    """
+
+    nodes = {}
+    edges = {}
+    for line in plain.splitlines():
+        fields = line.split(' ', 5)
+        if fields[0] == 'node':
+            nodes[fields[1]] = fields[2:4]
+        elif fields[0] == 'edge':
+            fields = line.split()
+            num = int(fields[3])
+            edges.setdefault((fields[1], fields[2]), []).append(fields[4:4 + 2 * num])
+
+    def end(name, port):
+        return f'{name}:{port}' if port else name
+
+    def points(coords):
+        # Plain output is in inches
+        return (np.array(coords, dtype=float).reshape(-1, 2) * 72).tolist()
+
+    edge_points = []
+    for tail, tailport, head, headport in desc['edges']:
+        path = points(edges[(end(tail, tailport), end(head, headport))].pop())
+        edge_points.append([path[-1]] + path)
+
+    def node_points(names):
+        return points([nodes[name] for name in names])
+
+    return {
+        'nodes': node_points(f'n{i}' for i in range(len(desc['nodes']))),
+        'inputs': node_points(f'i{i}' for i in range(desc['inputs'])),
+        'outputs': node_points(f'o{i}' for i in range(desc['outputs'])),
+        'edges': edge_points
+    }
+
+
+def run_dot(desc, external=False):
+    """Lays out a hierarchical node with dot.
+
+    The node is given by its layout description: for each child node its
+    size and the offsets of its ports from the top (None for minimized ones),
+    the number of node's own input and output ports, and the edges between
+    them. Returns the geometry as plain lists: center points of the child
+    nodes and the ports, and the spline points of each edge.
+
+    If external is set, dot is run as a separate process instead of through
+    the graphviz library, which lets other Python threads run meanwhile.
+    """
+
+    graph = pgv.AGraph(directed=True, rankdir='LR', splines='true', strict=False)
+
+    for i in range(desc['inputs']):
+        graph.add_node(f'i{i}', label='', width=1 / 72, height=1 / 72)
+
+    for i in range(desc['outputs']):
+        graph.add_node(f'o{i}', label='', width=1 / 72, height=1 / 72)
+
+    for i, node in enumerate(desc['nodes']):
+        if node is None:
+            graph.add_node(f'n{i}', shape='none', margin=0, label='', width=1 / 72, height=1 / 72)
+        else:
+            label = record_label(*node['size'], tuple(node['inputs']), tuple(node['outputs']))
+            graph.add_node(f'n{i}', shape='none', margin=0, label=label)
+
+    for i, (tail, tailport, head, headport) in enumerate(desc['edges']):
+        graph.add_edge(tail, head, tailport=tailport, headport=headport, key=str(i))
+
+    graph.add_subgraph([f'i{i}' for i in range(desc['inputs'])], 'sources', rank='same')
+    graph.add_subgraph([f'o{i}' for i in range(desc['outputs'])], 'sink', rank='same')
+
+    if external:
+        res = subprocess.run(['dot', '-Tplain-ext'],
+                             input=graph.string(),
+                             stdout=subprocess.PIPE,
+                             universal_newlines=True,
+                             check=True)
+        plain = res.stdout
+    else:
+        # Lays out and renders in a single library call, instead of storing
+        # the geometry into the string attributes of the graph
+        plain = graph.draw(format='plain-ext', prog='dot').decode()
+
+    return plain_load(plain, desc)
+
+
+# Layout engines by name, each takes the layout description and whether it
+# may run external processes, and returns the geometry in the run_dot format
+LAYOUT_ENGINES = {
+    'dot': run_dot,
+    'sugiyama': run_sugiyama,
+}
+
+
+def run_layout(desc, engine='dot', external=False):
+    return LAYOUT_ENGINES[engine](desc, external)
+
+
+def limit_worker_memory(mem_cap):
+    # Runs in the pre-layout worker processes, so that a runaway dot fails
+    # with MemoryError instead of exhausting the machine
+    if mem_cap is None:
+        return
+
+    try:
+        import resource
+    except ImportError:
+        return
+
+    limit = mem_cap * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def serve(mem_cap=None):
+    """Pre-layout worker loop. Reads the [engine, description] requests from
+    stdin and answers each with the geometry, or the error, on stdout, one
+    JSON document per line."""
+
+    limit_worker_memory(mem_cap)
+
+    for line in sys.stdin:
+        engine, desc = json.loads(line)
+        try:
+            reply = {'geometry': run_layout(desc, engine)}
+        except Exception as e:
+            reply = {'error': f'{type(e).__name__}: {e}'}
+
+        print(json.dumps(reply), flush=True)
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,280 @@
+import json
+import shutil
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from PySide2 import QtCore, QtGui, QtWidgets
+from pygears.conf import reg
+
+from .graph_layout import cache_layout, cached_layout
+from .layout_engine import run_layout
+from .node import NodeItem, apply_layout, layout_description
+from .node_model import NodeModel
+from .utils import module_env
+
+
+def dirty_levels(top):
+    """Groups the expanded hierarchical nodes that need a relayout by their
+    depth, top level first."""
+
+    levels = []
+    nodes = [(top, 0)]
+    while nodes:
+        node, depth = nodes.pop()
+        if not node.layout_dirty or node.collapsed:
+            continue
+
+        if len(levels) == depth:
+            levels.append([])
+
+        levels[depth].append(node)
+
+        for child in node._nodes:
+            if isinstance(child, NodeItem) and child.model.hierarchical:
+                nodes.append((child, depth + 1))
+
+    return levels
+
+
+class LayoutPipeline(QtCore.QObject):
+    """Lays out the graph with the layout engine running in worker threads.
+
+    Hierarchical nodes are laid out bottom-up, one depth level at a time,
+    since a node's layout depends on the sizes of its children. Worker
+    threads only turn the layout descriptions into geometry, while the scene
+    items are updated from the GUI thread as the results arrive.
+    """
+
+    progress = QtCore.Signal(int, int)
+    done = QtCore.Signal()
+    laid_out = QtCore.Signal(object, object, object)
+
+    def __init__(self, top):
+        super().__init__()
+        self.top = top
+        self.executor = ThreadPoolExecutor(max_workers=reg['gearbox/graph_layout/workers'])
+        self.engine = reg['gearbox/graph_layout/engine']
+        self.external = shutil.which('dot') is not None
+        self.laid_out.connect(self.apply)
+        self.levels = []
+        self.cancelled = False
+        self.pending = 0
+        self.completed = 0
+        self.total = 0
+
+    def start(self):
+        self.levels = dirty_levels(self.top)
+        self.total = sum(len(level) for level in self.levels)
+        self.completed = 0
+        self.next_level()
+
+    def cancel(self):
+        self.cancelled = True
+        self.levels = []
+        self.executor.shutdown(wait=False)
+
+    def next_level(self):
+        if not self.levels:
+            self.executor.shutdown(wait=False)
+            self.done.emit()
+            return
+
+        level = self.levels.pop()
+        self.pending = len(level)
+
+        for node in level:
+            # Layouts of the collapsed children do not involve the engine and need
+            # the scene items, so they are done right away
+            for child in node._nodes:
+                if hasattr(child, 'layout'):
+                    child.layout()
+
+            desc = layout_description(node)
+            key, geometry = cached_layout(desc, self.engine)
+            if geometry is not None:
+                self.apply(node, key, geometry)
+            else:
+                future = self.executor.submit(run_layout, desc, self.engine, self.external)
+                future.add_done_callback(
+                    lambda f, node=node, key=key: self.laid_out.emit(node, key, f))
+
+    def apply(self, node, key, geometry):
+        # Called through a queued connection when the geometry comes from a
+        # worker thread
+        if self.cancelled:
+            return
+
+        if not isinstance(geometry, dict):
+            try:
+                geometry = geometry.result()
+            except Exception as e:
+                print(f'Layout of {node.model.name} failed: {e}')
+                geometry = run_layout(layout_description(node), self.engine)
+
+            cache_layout(key, geometry)
+
+        apply_layout(node, geometry)
+        node.layout_dirty = False
+
+        self.completed += 1
+        self.progress.emit(self.completed, self.total)
+
+        self.pending -= 1
+        if self.pending == 0:
+            self.next_level()
+
+
+class PreLayout(QtCore.QObject):
+    """Lays out all hierarchy levels in advance to fill the layout cache.
+
+    Hierarchy is walked depth first on the GUI thread, a few nodes at a time
+    between the other events. For each hierarchical node, the items of its
+    children are built, and the layout it will need when expanded is
+    described and sent to a worker process, so that the first expansion of
+    the node is served from the cache. Items built only for the description
+    are freed once the subtree is described.
+
+    Workers are run as "python -m gearbox.layout_engine", so that they never
+    import the GUI, and exchange the descriptions and the geometry with
+    gearbox as JSON lines.
+    """
+
+    # Number of hierarchical nodes described per event loop pass
+    BATCH = 8
+
+    def __init__(self, top_model):
+        super().__init__()
+        # Nodes to describe, and the markers of the described subtrees whose
+        # temporary items are to be freed
+        self.stack = [(top_model, None)]
+        self.submitted = 0
+        self.engine = reg['gearbox/graph_layout/engine']
+        self.workers = []
+        # Cache keys of the requests sent to each worker, in order
+        self.pending = {}
+        for _ in range(reg['gearbox/graph_layout/prelayout_workers']):
+            self.start_worker(reg['gearbox/graph_layout/prelayout_mem'])
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.step)
+        self.timer.start(0)
+
+    def start_worker(self, mem_cap):
+        worker = QtCore.QProcess(self)
+        worker.setProcessChannelMode(QtCore.QProcess.ForwardedErrorChannel)
+
+        env = QtCore.QProcessEnvironment()
+        for name, val in module_env().items():
+            env.insert(name, val)
+
+        worker.setProcessEnvironment(env)
+
+        worker.readyReadStandardOutput.connect(partial(self.laid_out, worker))
+        worker.finished.connect(partial(self.worker_finished, worker))
+        worker.errorOccurred.connect(partial(self.worker_failed, worker))
+
+        args = ['-m', 'gearbox.layout_engine']
+        if mem_cap is not None:
+            args.append(str(mem_cap))
+
+        self.workers.append(worker)
+        self.pending[worker] = deque()
+        worker.start(sys.executable, args)
+
+    def step(self):
+        for _ in range(self.BATCH):
+            if not self.stack:
+                self.timer.stop()
+                print(f'Pre-layout submitted {self.submitted} hierarchy levels')
+                self.finish()
+                return
+
+            model, release = self.stack.pop()
+            if release is not None:
+                # Unless the user expanded the node meanwhile
+                if release and (model.view is None or model.view.collapsed):
+                    model.release_child_views()
+
+                continue
+
+            built = not model.child_views
+            if built:
+                model.ensure_view()
+                model.create_child_views()
+
+            if model.parent is not None:
+                self.describe(model)
+
+            self.stack.append((model, built))
+            for child in model.child:
+                if isinstance(child, NodeModel) and child.hierarchical:
+                    self.stack.append((child, None))
+
+    def describe(self, model):
+        view = model.view
+        for child in view._nodes:
+            if hasattr(child, 'layout'):
+                child.layout()
+
+        desc = layout_description(view)
+        key, geometry = cached_layout(desc, self.engine)
+        if key is None or geometry is not None or not self.workers:
+            return
+
+        self.submitted += 1
+        worker = min(self.workers, key=lambda w: len(self.pending[w]))
+        self.pending[worker].append(key)
+        worker.write((json.dumps([self.engine, desc]) + '\n').encode())
+
+    def laid_out(self, worker):
+        while worker.canReadLine():
+            key = self.pending[worker].popleft()
+            reply = json.loads(bytes(worker.readLine()).decode())
+            if 'error' in reply:
+                # Node will be laid out on demand when expanded
+                print(f'Pre-layout failed: {reply["error"]}')
+            else:
+                cache_layout(key, reply['geometry'])
+
+    def worker_failed(self, worker, error):
+        # Workers that fail to start never finish
+        if error == QtCore.QProcess.FailedToStart:
+            print(f'Pre-layout worker failed to start: {worker.errorString()}')
+            self.worker_finished(worker, None)
+
+    def worker_finished(self, worker, exit_code, exit_status=None):
+        if self.pending[worker]:
+            print(f'Pre-layout worker exited with code {exit_code}, '
+                  f'{len(self.pending[worker])} layouts dropped')
+            self.pending[worker].clear()
+
+        if worker in self.workers:
+            self.workers.remove(worker)
+
+    def finish(self):
+        # Workers exit once they answer all the requests
+        for worker in self.workers:
+            worker.closeWriteChannel()
+
+    def cancel(self):
+        self.timer.stop()
+        self.stack = []
+        for worker in list(self.workers):
+            self.pending[worker].clear()
+            worker.kill()
+
+
+class LayoutPlaceholder(QtWidgets.QGraphicsSimpleTextItem):
+    def __init__(self, scene):
+        super().__init__('Laying out the graph...')
+        self.setBrush(QtGui.QColor('#a0a0a0'))
+        scene.addItem(self)
+
+    def progress(self, completed, total):
+        self.setText(f'Laying out the graph... {completed}/{total}')
+
+    def delete(self):
+        if self.scene():
+            self.scene().removeItem(self)
@@ -0,0 +1,18 @@
+from PySide2 import QtWidgets
+
+from .constants import LOD_THRESHOLD
+
+
+def low_detail(painter, option):
+    """Whether the item is zoomed out too far for its details to be legible."""
+    return option.levelOfDetailFromTransform(painter.worldTransform()) < LOD_THRESHOLD
+
+
+class LodTextItem(QtWidgets.QGraphicsTextItem):
+    """Text item which is not drawn when zoomed out past the LOD threshold."""
+
+    def paint(self, painter, option, widget):
+        if low_detail(painter, option):
+            return
+
+        super().paint(painter, option, widget)
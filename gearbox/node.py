@@ -1,12 +1,14 @@
-import pygraphviz as pgv
-from PySide2 import QtCore, QtGui, QtWidgets
+from PySide2 import QtCore, QtGui
 
 from pygears.conf import Inject, inject
 from pygears.core.port import InPort
 
-from . import gv_utils
 from .constants import NODE_SEL_BORDER_COLOR, NODE_SEL_COLOR, Z_VAL_NODE
+from .graph_layout import graph_layout
+from .heatmap import heat_color
+from .lod import LodTextItem, low_detail
 from .node_abstract import AbstractNodeItem
+from .node_layers import NodeLayers
 from .pipe import Pipe
 from .port import PortItem
 from .theme import themify
@@ -29,6 +31,10 @@ def node_layout(self):
 
 
 def minimized_painter(self, painter, option, widget):
+    if low_detail(painter, option):
+        painter.fillRect(QtCore.QRectF(5, 5, self._width, self._height), QtGui.QColor(*self.color))
+        return
+
     painter.save()
     painter.setBrush(QtGui.QColor(*self.color))
     painter.setPen(QtCore.Qt.NoPen)
@@ -61,171 +67,105 @@ def minimized_layout(self):
         text.hide()
 
 
-def hier_layout(self):
-    if self.collapsed:
-        node_layout(self)
-        return
+def layout_description(self):
+    """Describes the layout problem of an expanded hierarchical node with plain
+    data, which is all that the layout engines need and which keys the layout
+    cache."""
 
-    for node in self._nodes:
-        if hasattr(node, 'layout'):
-            node.layout()
+    index = {node: i for i, node in enumerate(self._nodes)}
 
+    nodes = []
     for node in self._nodes:
-        gvn = self.get_layout_node(node)
-        try:
-            del gvn.attr['width']
-            del gvn.attr['height']
-        except KeyError:
-            pass
-
         if node._layout != minimized_layout:
-            # gvn.attr['label'] = gv_utils.get_node_record(node).replace(
-            #     '\n', '')
-            node_layout_rec = gv_utils.get_node_record(node)
-            # print('-' * 60)
-            # print(f'Node layout for {node.model.name}')
-            # print('-' * 60)
-            # print(node_layout_rec)
-            gvn.attr['label'] = node_layout_rec.replace('\n', '')
+            nodes.append({
+                'size': [node.width, node.height],
+                'inputs': [p.y() + p._height / 2 for p in node.inputs],
+                'outputs': [p.y() + p._height / 2 for p in node.outputs]
+            })
         else:
-            gvn.attr['label'] = ""
-            gvn.attr['width'] = 1 / 72
-            gvn.attr['height'] = 1 / 72
+            nodes.append(None)
 
-    if not self.layout_graph.subgraphs():
-        self.layout_graph.add_subgraph([
-            self.layout_graph.get_node(f'i{i}')
-            for i in range(len(self.inputs))
-        ],
-                                       'sources',
-                                       rank='same')
-        self.layout_graph.add_subgraph([
-            self.layout_graph.get_node(f'o{i}')
-            for i in range(len(self.outputs))
-        ],
-                                       'sink',
-                                       rank='same')
+    edges = []
+    for pipe in self.pipes:
+        node1 = pipe.output_port.parentItem()
+        node2 = pipe.input_port.parentItem()
+
+        if node1 is self:
+            tail, tailport = f'i{pipe.output_port.model.index}', ''
+        else:
+            tail = f'n{index[node1]}'
+            tailport = ''
+            if node1._layout != minimized_layout:
+                tailport = f'o{pipe.output_port.model.index}'
 
-    # for i in range(len(self.inputs)):
-    #     gvn = self.layout_graph.get_node(f'i{i}')
+        if node2 is self:
+            head, headport = f'o{pipe.input_port.model.index}', ''
+        else:
+            head = f'n{index[node2]}'
+            headport = ''
+            if node2._layout != minimized_layout:
+                headport = f'i{pipe.input_port.model.index}'
 
-    # for i in range(len(self.outputs)):
-    #     gvn = self.layout_graph.get_node(f'o{i}')
+        edges.append([tail, tailport, head, headport])
 
-    # for pipe in self.pipes:
-    #     gve = self.get_layout_edge(pipe)
+    return {
+        'nodes': nodes,
+        'inputs': len(self.inputs),
+        'outputs': len(self.outputs),
+        'edges': edges
+    }
 
-    self.layout_graph.layout(prog='dot')
 
-    # if self.model.name == '/riscv':
-    #     # if self.model.name == '':
-    #     self.layout_graph.draw('proba.png')
-    #     self.layout_graph.draw('proba.dot')
+def hier_layout(self):
+    if self.collapsed:
+        node_layout(self)
+        return
 
-    # self.layout_graph.draw(f'{self.model.name.replace("/", "_")}.png')
-    # self.layout_graph.draw(f'{self.model.name.replace("/", "_")}.dot')
+    for node in self._nodes:
+        if hasattr(node, 'layout'):
+            node.layout()
 
-    def gv_point_load(point):
-        return tuple(float(num) for num in point.split(',')[-2:])
+    apply_layout(self, graph_layout(layout_description(self)))
 
-    # if self.name:
-    #     import pdb; pdb.set_trace()
 
+def apply_layout(self, geometry):
     padding_y = 40
     padding_x = -5
 
     bounding_box = None
     # print(f"Layout for: {node.name}")
-    for node in self._nodes:
-        gvn = self.get_layout_node(node)
-        pos = gv_point_load(gvn.attr['pos'])
+    for node, pos in zip(self._nodes, geometry['nodes']):
         node_bounding_box = QtCore.QRectF(pos[0] - node.width / 2,
                                           pos[1] - node.height / 2, node.width,
                                           node.height)
-        # print(
-        #     f'  bb: {node.name}: {pos[0], pos[1], float(gvn.attr["width"])*72, float(gvn.attr["height"])*72} -> {node_bounding_box}'
-        # )
         node.setPos(node_bounding_box.x(), node_bounding_box.y())
         if bounding_box is None:
             bounding_box = node_bounding_box
         else:
             bounding_box = bounding_box.united(node_bounding_box)
 
-    if self.inputs:
-        port_height = self.inputs[0].boundingRect().height()
-
-        for i, p in enumerate(self.inputs):
-            gvn = self.layout_graph.get_node(f'i{i}')
-            pos = gv_point_load(gvn.attr['pos'])
-            node_bounding_box = QtCore.QRectF(pos[0] - port_height / 2,
-                                              pos[1] - port_height / 2 + 0.5,
-                                              port_height, port_height)
-            # print(
-            #     f'  bb: {p.name}: {pos[0], pos[1], float(gvn.attr["width"])*72, float(gvn.attr["height"])*72} -> {node_bounding_box}'
-            # )
-            p.setPos(node_bounding_box.x(), node_bounding_box.y())
-            bounding_box = bounding_box.united(node_bounding_box)
+    for ports, port_pos in ((self.inputs, geometry['inputs']), (self.outputs,
+                                                                geometry['outputs'])):
+        if not ports:
+            continue
 
-    if self.outputs:
-        port_height = self.outputs[0].boundingRect().height()
+        port_height = ports[0].boundingRect().height()
 
-        for i, p in enumerate(self.outputs):
-            gvn = self.layout_graph.get_node(f'o{i}')
-            pos = gv_point_load(gvn.attr['pos'])
+        for p, pos in zip(ports, port_pos):
             node_bounding_box = QtCore.QRectF(pos[0] - port_height / 2,
                                               pos[1] - port_height / 2 + 0.5,
                                               port_height, port_height)
-            # print(
-            #     f'  bb: {p.name}: {pos[0], pos[1], float(gvn.attr["width"])*72, float(gvn.attr["height"])*72} -> {node_bounding_box}'
-            # )
             p.setPos(node_bounding_box.x(), node_bounding_box.y())
-            bounding_box = bounding_box.united(node_bounding_box)
-
-    for pipe in self.pipes:
-        gve = self.get_layout_edge(pipe)
-        path = [gv_point_load(point) for point in gve.attr['pos'].split()]
-        pipe.layout_path = [QtCore.QPointF(p[0], p[1]) for p in path]
-
-        # max_y = max(max_y, *(p.y() for p in pipe.layout_path))
-
-    self.layers = []
-
-    class Layer(list):
-        def __init__(self, node):
-            super().__init__([node])
-            self.rect = node.boundingRect()
-            self.rect.translate(node.pos())
-
-        def __str__(self):
-            return str(self.rect)
-
-        def __repr__(self):
-            return repr(self.rect)
-
-        def add(self, node):
-            rect = node.boundingRect()
-            rect.translate(node.pos())
-
-            if ((self.rect.left() < rect.right())
-                    and (self.rect.right() > rect.left())):
-                self.append(node)
-                self.sort(key=lambda n: n.y())
-                return True
+            if bounding_box is None:
+                bounding_box = node_bounding_box
             else:
-                return False
-
-    def find_layer(node):
-        for layer in self.layers:
-            if layer.add(node):
-                return
-        else:
-            self.layers.append(Layer(node))
+                bounding_box = bounding_box.united(node_bounding_box)
 
-    # print(f"  Bounding box: {bounding_box}")
+    if bounding_box is None:
+        bounding_box = QtCore.QRectF()
 
-    self.layers = sorted(self.layers, key=lambda l: l.rect.left())
-    for node in self._nodes:
-        find_layer(node)
+    for pipe, path in zip(self.pipes, geometry['edges']):
+        pipe.layout_path = [QtCore.QPointF(p[0], p[1]) for p in path]
 
     for item in (self._nodes + self.inputs + self.outputs):
         # node.setY(max_y - node.y() + padding)
@@ -241,6 +181,8 @@ def hier_layout(self):
     for p in self.outputs:
         p.setX(bounding_box.width() + padding_x)
 
+    self.layers = NodeLayers(self._nodes)
+
     for pipe in self.pipes:
         for p in pipe.layout_path:
             p.setX(p.x() - bounding_box.x() + padding_x)
@@ -266,7 +208,7 @@ def calc_node_size(self):
         input_widths = []
         for port, text in self._input_items.items():
             input_width = port.boundingRect().width() * 2
-            if text.isVisible():
+            if text.isVisibleTo(self):
                 input_width += text.boundingRect().width()
             input_widths.append(input_width)
         port_names_width += max(input_widths)
@@ -276,7 +218,7 @@ def calc_node_size(self):
         output_widths = []
         for port, text in self._output_items.items():
             output_width = port.boundingRect().width() * 2
-            if text.isVisible():
+            if text.isVisibleTo(self):
                 output_width += text.boundingRect().width()
             output_widths.append(output_width)
         port_names_width += max(output_widths)
@@ -314,20 +256,26 @@ def hier_expand(node, padding=40):
 
 
 def hier_painter(self, painter, option, widget):
-    painter.save()
-
     rect = self.boundingRect()
     color = (self.color[0], self.color[1], self.color[2], 50)
-    painter.setBrush(QtGui.QColor(*color))
-    painter.setPen(QtCore.Qt.NoPen)
-    painter.drawRect(rect)
-
     top_rect = QtCore.QRectF(0.0, 0.0, rect.width(), 20.0)
     if self.collapsed:
-        painter.setBrush(QtGui.QColor(themify(self.status_color)))
+        top_color = QtGui.QColor(themify(self.status_color))
     else:
-        painter.setBrush(QtGui.QColor(*self.border_color))
+        top_color = QtGui.QColor(*self.border_color)
+
+    if low_detail(painter, option):
+        painter.fillRect(rect, QtGui.QColor(*color))
+        painter.fillRect(top_rect, top_color)
+        return
+
+    painter.save()
 
+    painter.setBrush(QtGui.QColor(*color))
+    painter.setPen(QtCore.Qt.NoPen)
+    painter.drawRect(rect)
+
+    painter.setBrush(top_color)
     painter.setPen(QtCore.Qt.NoPen)
     painter.drawRect(top_rect)
 
@@ -351,6 +299,13 @@ def hier_painter(self, painter, option, widget):
 
 
 def node_painter(self, painter, option, widget):
+    if low_detail(painter, option):
+        rect = self.boundingRect()
+        painter.fillRect(rect, QtGui.QColor(*self.color))
+        painter.fillRect(QtCore.QRectF(rect.left(), rect.top(), rect.width(), 28),
+                         QtGui.QColor(themify(self.status_color)))
+        return
+
     painter.save()
 
     bg_border = 1.0
@@ -414,12 +369,10 @@ class NodeItem(AbstractNodeItem):
         self.parent = parent
         self.graph = graph
         self.model = model
-        self.layout_graph = pgv.AGraph(
-            directed=True, rankdir='LR', splines='true', strict=False)
 
         self.layout_pipe_map = {}
 
-        self._text_item = QtWidgets.QGraphicsTextItem(self.name, self)
+        self._text_item = LodTextItem(self.name, self)
         self._input_items = {}
         self._output_items = {}
         self._nodes = []
@@ -433,7 +386,10 @@ class NodeItem(AbstractNodeItem):
         self.layout_outport_vertices = {}
 
         self.collapsed = False if parent is None else True
-        self.layers = []
+        self.layers = NodeLayers([])
+        self.status = 'empty'
+        self.heat = None
+        self.layout_dirty = True
 
     def setup_done(self):
         self._hide_single_port_labels()
@@ -499,23 +455,25 @@ class NodeItem(AbstractNodeItem):
             obj.hide()
 
         self.collapsed = True
+        self.mark_dirty()
         self.size_expander(self)
         self.graph.top.layout()
         self.graph.ensureVisible(self)
         self.graph.node_expand_toggled.emit(False, self.model)
+        self.model.cache_child_views()
 
     def expand(self):
         if not self.collapsed or not self.model.hierarchical:
             return None
 
-        if not self.model.rtl_map:
-            self.model.load_children()
+        self.model.create_child_views()
 
         for obj in self.children:
             obj.show()
 
         self.collapsed = False
         self.show()
+        self.mark_dirty()
         self.graph.top.layout()
         self.graph.ensureVisible(self)
         self.selected = True
@@ -545,35 +503,36 @@ class NodeItem(AbstractNodeItem):
     def _add_port(self, port, display_name=True):
         port_item = PortItem(port, self)
         port_item.display_name = display_name
-        text = QtWidgets.QGraphicsTextItem(port_item.name, self)
+        text = LodTextItem(port_item.name, self)
         text.font().setPointSize(8)
         text.setFont(text.font())
         # text.setVisible(display_name)
 
         if isinstance(port, InPort):
-            port_node_name = f'i{len(self._input_items)}'
-            self.layout_graph.add_node(
-                port_node_name, label='', width=1 / 72, height=1 / 72)
             self._input_items[port_item] = text
         else:
-            port_node_name = f'o{len(self._output_items)}'
-            self.layout_graph.add_node(
-                port_node_name, label='', width=1 / 72, height=1 / 72)
-
             self._output_items[port_item] = text
 
         return port_item
 
     def set_status(self, status):
         self.status = status
-        if self.model.hierarchical:
-            status = f'{status}_hier'
+        if self.heat is not None:
+            new_color = heat_color(self.heat)
+        else:
+            if self.model.hierarchical:
+                status = f'{status}_hier'
+
+            new_color = NODE_SIM_STATUS_COLOR[status]
 
-        new_color = NODE_SIM_STATUS_COLOR[status]
         if new_color != self.status_color:
             self.status_color = new_color
             self.update()
 
+    def set_heat(self, heat):
+        self.heat = heat
+        self.set_status(self.status)
+
     @AbstractNodeItem.selected.setter
     def selected(self, selected=False):
         AbstractNodeItem.selected.fset(self, selected)
@@ -816,8 +775,8 @@ class NodeItem(AbstractNodeItem):
 
         node.update()
 
-        self.layout_graph.add_node(id(node), shape='none', margin=0)
         self._nodes.append(node)
+        self.mark_dirty()
 
     def add_pipe(self, pipe):
         if self.parent is not None:
@@ -826,38 +785,7 @@ class NodeItem(AbstractNodeItem):
             self.graph.scene().addItem(pipe)
 
         self.pipes.append(pipe)
-
-        node1 = pipe.output_port.parentItem()
-        node2 = pipe.input_port.parentItem()
-
-        tailport = ''
-        if node1._layout != minimized_layout:
-            tailport = f'o{pipe.output_port.model.index}'
-
-        headport = ''
-        if node2._layout != minimized_layout:
-            headport = f'i{pipe.input_port.model.index}'
-
-        if (node2 is not self) and (node1 is not self):
-            self.layout_graph.add_edge(
-                id(node1),
-                id(node2),
-                tailport=tailport,
-                headport=headport,
-                key=id(pipe))
-
-        elif (node2 is self):
-            self.layout_graph.add_edge(
-                id(node1),
-                f'o{pipe.input_port.model.index}',
-                tailport=tailport,
-                key=id(pipe))
-        else:
-            self.layout_graph.add_edge(
-                f'i{pipe.output_port.model.index}',
-                id(node2),
-                headport=headport,
-                key=id(pipe))
+        self.mark_dirty()
 
     @property
     def node_bounding_rect(self):
@@ -880,24 +808,18 @@ class NodeItem(AbstractNodeItem):
 
         return bound
 
-    def get_layout_edge(self, pipe):
-        node1 = pipe.output_port.node
-        node2 = pipe.input_port.node
-
-        if node1 is self:
-            node1_id = f'i{pipe.output_port.model.index}'
-        else:
-            node1_id = id(node1)
-
-        if node2 is self:
-            node2_id = f'o{pipe.input_port.model.index}'
-        else:
-            node2_id = id(node2)
-
-        return self.layout_graph.get_edge(node1_id, node2_id, id(pipe))
-
-    def get_layout_node(self, node):
-        return self.layout_graph.get_node(str(id(node)))
+    def mark_dirty(self):
+        """Marks the node and all its ancestors for relayout."""
+        node = self
+        while node is not None:
+            node.layout_dirty = True
+            node = node.parent
 
     def layout(self):
+        # Nodes whose contents did not change keep their geometry and are only
+        # moved around by their parent's layout
+        if not self.layout_dirty:
+            return
+
         self._layout(self)
+        self.layout_dirty = False
@@ -0,0 +1,44 @@
+from bisect import bisect_left
+
+
+class NodeLayers(list):
+    """Child nodes of a hierarchical node grouped into layers for the keyboard
+    navigation.
+
+    Layers are the columns of nodes whose horizontal extents overlap, found by
+    sweeping over the nodes sorted by their left edge. Each layer is a list of
+    nodes sorted from top to bottom.
+    """
+
+    def __init__(self, nodes):
+        super().__init__()
+
+        right = None
+        for node in sorted(nodes, key=lambda n: n.x()):
+            if right is None or node.x() >= right:
+                self.append([])
+                right = node.x()
+
+            self[-1].append(node)
+            right = max(right, node.x() + node.boundingRect().width())
+
+        self.tops = []
+        self.index = {}
+        for layer_id, layer in enumerate(self):
+            layer.sort(key=lambda n: n.y())
+            self.tops.append([n.y() for n in layer])
+            for node_id, node in enumerate(layer):
+                self.index[node] = (layer_id, node_id)
+
+    def locate(self, node):
+        """Returns the layer index and the position of the node within it."""
+        return self.index[node]
+
+    def closest(self, layer_id, y):
+        """Returns the node of the layer whose top is the closest to y."""
+        tops = self.tops[layer_id]
+        i = bisect_left(tops, y)
+        if i == len(tops) or (i > 0 and y - tops[i - 1] <= tops[i] - y):
+            i -= 1
+
+        return self[layer_id][i]
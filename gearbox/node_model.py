@@ -1,14 +1,16 @@
 import inspect
 import os
-import functools
+from collections import OrderedDict
 from pygears.sim.modules import SimVerilated, SimSocket
 from pygears.core.hier_node import HierVisitorBase
-from pygears.core.hier_node import NamedHierNode
 from pygears.conf import inject, Inject, reg
 from .node import NodeItem, hier_expand, hier_painter, node_painter, minimized_painter
 from .node import node_layout, hier_layout, minimized_layout
+from .node_layers import NodeLayers
+from .hier_model import HierNode
 from pygears.sim.modules.cosim_base import CosimBase
 from .pipe import Pipe
+from .lod import LodTextItem
 from .html_utils import highlight, tabulate, highlight_style
 from pygears.core.partial import Partial
 from pygears.core.port import InPort, HDLProducer, HDLConsumer
@@ -50,7 +52,6 @@ from .node_abstract import AbstractNodeItem
 
 from .port import PortItem
 from pygears.core.port import OutPort
-from PySide2 import QtWidgets
 
 
 class DummyInNode(AbstractNodeItem):
@@ -62,11 +63,11 @@ class DummyInNode(AbstractNodeItem):
         self._output_items = {}
         self.painter = minimized_painter
         self.outputs = [PortItem(InPort(parent.rtl, index, 'dummy'), self)]
-        port_text = QtWidgets.QGraphicsTextItem('dummy', self)
+        port_text = LodTextItem('dummy', self)
         self._output_items[self.outputs[0]] = port_text
 
         self.inputs = []
-        self._text_item = QtWidgets.QGraphicsTextItem('', self)
+        self._text_item = LodTextItem('', self)
         self.layout()
 
     def paint(self, painter, option, widget):
@@ -85,11 +86,11 @@ class DummyOutNode(AbstractNodeItem):
         self._output_items = {}
         self.painter = minimized_painter
         self.inputs = [PortItem(OutPort(parent.rtl, index, 'dummy'), self)]
-        port_text = QtWidgets.QGraphicsTextItem('dummy', self)
+        port_text = LodTextItem('dummy', self)
         self._input_items[self.inputs[0]] = port_text
 
         self.outputs = []
-        self._text_item = QtWidgets.QGraphicsTextItem('', self)
+        self._text_item = LodTextItem('', self)
         self.layout()
 
     def paint(self, painter, option, widget):
@@ -99,18 +100,52 @@ class DummyOutNode(AbstractNodeItem):
         self._layout(self)
 
 
-class PipeModel(NamedHierNode):
+class PipeModel(HierNode):
+    __slots__ = ('svintf', 'rtl', 'view', 'heat', 'status', 'consumer_id', 'producer', 'consumer',
+                 '_name', '_basename')
+
     def __init__(self, intf, consumer_id, parent=None):
         super().__init__(parent=parent)
 
         self.svintf = reg['hdlgen/map'].get(intf, None)
 
         self.rtl = intf
+        self.view = None
+        self.heat = None
+        self._name = None
+        self._basename = None
 
         self.consumer_id = consumer_id
         output_port_model = intf.producer
         input_port_model = intf.consumers[consumer_id]
 
+        if output_port_model.gear is parent.rtl:
+            # parent.input_int_pipes[output_port_model.index] = self
+            self.producer = parent
+            self.producer.input_int_pipes.append(self)
+        else:
+            # parent.rtl_map[output_port_model.node].output_ext_pipes[
+            #     output_port_model.index] = self
+            self.producer = parent.rtl_map[output_port_model.gear]
+            self.producer.output_ext_pipes.append(self)
+
+        if input_port_model.gear is parent.rtl:
+            self.consumer = parent
+            self.consumer.output_int_pipes.append(self)
+        else:
+            self.consumer = parent.rtl_map[input_port_model.gear]
+            self.consumer.input_ext_pipes.append(self)
+
+        if self.consumer.related_issues:
+            self.set_status('error')
+        else:
+            self.set_status('empty')
+
+    def create_view(self):
+        parent = self.parent
+        output_port_model = self.rtl.producer
+        input_port_model = self.rtl.consumers[self.consumer_id]
+
         if output_port_model.gear is parent.rtl:
             try:
                 output_port = parent.view.inputs[output_port_model.index]
@@ -118,18 +153,10 @@ class PipeModel(NamedHierNode):
                 node = DummyInNode(parent, output_port_model.index)
                 parent.view.add_node(node)
                 output_port = node.outputs[0]
-
-            # parent.input_int_pipes[output_port_model.index] = self
-            parent.input_int_pipes.append(self)
         else:
             output_port = parent[output_port_model.gear.basename].view.outputs[
                 output_port_model.index]
 
-            # parent.rtl_map[output_port_model.node].output_ext_pipes[
-            #     output_port_model.index] = self
-            parent.rtl_map[output_port_model.gear].output_ext_pipes.append(
-                self)
-
         try:
             if input_port_model.gear is parent.rtl:
                 try:
@@ -138,33 +165,37 @@ class PipeModel(NamedHierNode):
                     node = DummyOutNode(parent, input_port_model.index)
                     parent.view.add_node(node)
                     input_port = node.inputs[0]
-
-                self.consumer = parent
-                self.consumer.output_int_pipes.append(self)
             else:
                 input_port = parent[input_port_model.gear.
                                     basename].view.inputs[input_port_model.
                                                           index]
-                self.consumer = parent.rtl_map[input_port_model.gear]
-                self.consumer.input_ext_pipes.append(self)
 
         except AttributeError:
             import pdb
             pdb.set_trace()
 
         self.view = Pipe(output_port, input_port, parent.view, self)
-        self.parent.view.add_pipe(self.view)
+        parent.view.add_pipe(self.view)
 
-        if self.consumer.related_issues:
-            self.set_status('error')
-        else:
-            self.set_status('empty')
+        self.view.set_status(self.status)
+        if self.heat is not None:
+            self.view.set_heat(self.heat)
+
+    @property
+    def visible(self):
+        return self.view is not None and self.view.isVisible()
 
     @inject
     def set_status(self, status, timestep=Inject('gearbox/timekeep')):
         self.status = (timestep, status)
         self.status = status
-        self.view.set_status(status)
+        if self.view is not None:
+            self.view.set_status(status)
+
+    def set_heat(self, heat):
+        self.heat = heat
+        if self.view is not None:
+            self.view.set_heat(heat)
 
     @property
     def description(self):
@@ -176,36 +207,83 @@ class PipeModel(NamedHierNode):
         return tooltip
 
     @property
-    @functools.lru_cache(maxsize=None)
     def name(self):
-        name = self.rtl.name
-        if self.svintf is not None:
-            name = name.split('.')[0] + '.' + self.svintf.basename
+        if self._name is None:
+            name = self.rtl.name
+            if self.svintf is not None:
+                name = name.split('.')[0] + '.' + self.svintf.basename
 
-        if len(self.rtl.consumers) > 1:
-            return f'{name}_bc_{self.consumer_id}'
-        else:
-            return name
+            if len(self.rtl.consumers) > 1:
+                name = f'{name}_bc_{self.consumer_id}'
+
+            self._name = name
+
+        return self._name
 
     @property
-    @functools.lru_cache(maxsize=None)
     def basename(self):
-        if self.svintf is not None:
-            basename = self.svintf.basename
-        else:
-            basename = self.rtl.basename
+        if self._basename is None:
+            if self.svintf is not None:
+                basename = self.svintf.basename
+            else:
+                basename = self.rtl.basename
 
-        if len(self.rtl.consumers) > 1:
-            return f'{basename}_bc_{self.consumer_id}'
-        else:
-            return basename
+            if len(self.rtl.consumers) > 1:
+                basename = f'{basename}_bc_{self.consumer_id}'
+
+            self._basename = basename
+
+        return self._basename
+
+    def clear(self):
+        super().clear()
+        self._name = None
+        self._basename = None
+        self.producer = None
+        self.consumer = None
+        self.view = None
 
     @property
     def hierarchical(self):
         return False
 
 
-class NodeModel(NamedHierNode):
+class ViewCache:
+    """Collapsed hierarchical nodes that keep the Qt items of their subtrees.
+
+    Items of a subtree are built when its root node is first expanded. After
+    the node is collapsed, they are kept so that expanding the node again is
+    quick, but only for the given number of most recently collapsed nodes.
+    The least recently collapsed ones free their items, keeping only the
+    models.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.nodes = OrderedDict()
+
+    def add(self, model):
+        self.nodes[model] = None
+        self.nodes.move_to_end(model)
+
+        if self.size is None:
+            return
+
+        while len(self.nodes) > self.size:
+            oldest, _ = self.nodes.popitem(last=False)
+            oldest.release_child_views()
+
+    def discard(self, model):
+        self.nodes.pop(model, None)
+
+    def clear(self):
+        self.nodes.clear()
+
+
+class NodeModel(HierNode):
+    __slots__ = ('rtl', 'input_ext_pipes', 'output_ext_pipes', 'input_int_pipes',
+                 'output_int_pipes', 'rtl_map', 'view', 'child_views', 'heat', 'status')
+
     def __init__(self, gear, parent=None):
         super().__init__(parent=parent)
 
@@ -224,6 +302,26 @@ class NodeModel(NamedHierNode):
 
         self.rtl_map = {}
 
+        # Qt items are built only for the nodes whose parent was expanded
+        self.view = None
+        self.child_views = False
+        self.heat = None
+
+        # if parent is None:
+        #     self.load_children()
+        # if parent is None:
+        #     breakpoint()
+
+        if parent is None or parent.parent is None:
+            self.load_children()
+
+        # import pdb; pdb.set_trace()
+        if self.on_error_path:
+            self.set_status('error')
+        else:
+            self.set_status('empty')
+
+    def create_view(self):
         layout = hier_layout if self.hierarchical else node_layout
         painter = None
         try:
@@ -240,31 +338,91 @@ class NodeModel(NamedHierNode):
             pass
 
         self.view = NodeItem(
-            gear.basename,
+            self.rtl.basename,
             layout=layout,
-            parent=(None if parent is None else parent.view),
+            parent=(None if self.parent is None else self.parent.view),
             model=self)
 
-        if parent is not None:
-            parent.view.add_node(self.view)
+        if self.parent is not None:
+            self.parent.view.add_node(self.view)
             for port in self.rtl.in_ports + self.rtl.out_ports:
                 self.view._add_port(port)
 
         self.setup_view(painter=painter)
 
-        # if parent is None:
-        #     self.load_children()
-        # if parent is None:
-        #     breakpoint()
+        self.view.set_status(self.status[1])
+        if self.heat is not None:
+            self.view.set_heat(self.heat)
 
-        if parent is None or parent.parent is None:
+    def ensure_view(self):
+        """Builds the Qt items along the path from the top to this node."""
+        if self.view is None:
+            self.parent.ensure_view()
+            self.parent.create_child_views()
+
+    @inject
+    def create_child_views(self, view_cache=Inject('gearbox/graph_view_cache')):
+        """Builds the Qt items of the child nodes and the pipes between them,
+        loading the child models first if needed."""
+
+        view_cache.discard(self)
+
+        if self.child_views:
+            return
+
+        if not self.rtl_map:
             self.load_children()
 
-        # import pdb; pdb.set_trace()
-        if self.on_error_path:
-            self.set_status('error')
-        else:
-            self.set_status('empty')
+        for child in self.child:
+            child.create_view()
+
+            if self.parent is not None:
+                child.view.hide()
+
+        self.child_views = True
+
+    @inject
+    def cache_child_views(self, view_cache=Inject('gearbox/graph_view_cache')):
+        """Called when the node is collapsed, its subtree items are kept only
+        while the node is among the most recently collapsed ones."""
+        if self.child_views:
+            view_cache.add(self)
+
+    @inject
+    def release_child_views(self, view_cache=Inject('gearbox/graph_view_cache')):
+        """Frees the Qt items of the node's subtree, keeping the models."""
+        view_cache.discard(self)
+
+        if not self.child_views:
+            return
+
+        for child in self.child:
+            if isinstance(child, NodeModel):
+                child.release_child_views()
+
+        view = self.view
+        for item in view._nodes + view.pipes:
+            if item.scene():
+                item.scene().removeItem(item)
+
+        view._nodes = []
+        view.pipes = []
+        view.layers = NodeLayers([])
+        view.mark_dirty()
+
+        for child in self.child:
+            child.view = None
+
+        self.child_views = False
+
+    def clear(self):
+        super().clear()
+        self.input_ext_pipes = []
+        self.output_ext_pipes = []
+        self.input_int_pipes = []
+        self.output_int_pipes = []
+        self.rtl_map = {}
+        self.view = None
 
     def load_children(self):
         if not self.hierarchical:
@@ -273,9 +431,6 @@ class NodeModel(NamedHierNode):
         for child in self.rtl.child:
             self.rtl_map[child] = NodeModel(child, self)
 
-            if self.parent is not None:
-                self.rtl_map[child].view.hide()
-
         for child in self.rtl.local_intfs:
             for i in range(len(child.consumers)):
                 if isinstance(child.producer, HDLProducer):
@@ -291,9 +446,6 @@ class NodeModel(NamedHierNode):
                 self.rtl_map[child] = PipeModel(
                     child, consumer_id=i, parent=self)
 
-                if self.parent is not None:
-                    self.rtl_map[child].view.hide()
-
     def __getitem__(self, path):
         return super().__getitem__(path.replace('.', '/'))
 
@@ -321,7 +473,17 @@ class NodeModel(NamedHierNode):
     @inject
     def set_status(self, status, timestep=Inject('gearbox/timekeep')):
         self.status = (timestep, status)
-        self.view.set_status(status)
+        if self.view is not None:
+            self.view.set_status(status)
+
+    def set_heat(self, heat):
+        self.heat = heat
+        if self.view is not None:
+            self.view.set_heat(heat)
+
+    @property
+    def expanded(self):
+        return self.view is not None and not self.view.collapsed
 
     @property
     @inject
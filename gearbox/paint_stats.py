@@ -0,0 +1,48 @@
+import time
+
+from PySide2 import QtCore, QtGui
+
+
+class PaintStats:
+    """Frame rate and average repaint time of a graphics view, drawn in its
+    top left corner.
+
+    The view reports each of its paint events, and the overlay is refreshed
+    periodically, so that the refresh does not itself cause a full repaint.
+    """
+
+    def __init__(self, view, period=500):
+        self.view = view
+        self.frames = 0
+        self.paint_time = 0.0
+        self.text = ''
+        self.rect = QtCore.QRect(0, 0, 240, 20)
+        self.last = time.perf_counter()
+
+        self.timer = QtCore.QTimer(view)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(period)
+
+    def painted(self, rect, paint_time):
+        # Repaints of the overlay alone are not counted
+        if rect == self.rect:
+            return
+
+        self.frames += 1
+        self.paint_time += paint_time
+
+    def refresh(self):
+        now = time.perf_counter()
+        fps = self.frames / (now - self.last)
+        repaint = 1000 * self.paint_time / self.frames if self.frames else 0.0
+        self.text = f'{fps:5.1f} fps, {repaint:6.2f} ms/repaint'
+
+        self.frames = 0
+        self.paint_time = 0.0
+        self.last = now
+        self.view.viewport().update(self.rect)
+
+    def draw(self, painter):
+        painter.fillRect(self.rect, QtGui.QColor(0, 0, 0, 160))
+        painter.setPen(QtGui.QColor(255, 255, 255))
+        painter.drawText(self.rect.adjusted(5, 0, 0, 0), QtCore.Qt.AlignVCenter, self.text)
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+from functools import lru_cache
 from PySide2 import QtCore, QtGui, QtWidgets
 from pygears.conf import inject
 
@@ -7,6 +8,8 @@ from .constants import (
     PIPE_DEFAULT_COLOR, PIPE_ACTIVE_COLOR, PIPE_HIGHLIGHT_COLOR,
     PIPE_STYLE_DASHED, PIPE_STYLE_DEFAULT, PIPE_STYLE_DOTTED, PIPE_WIDTH,
     IN_PORT, OUT_PORT, Z_VAL_PIPE, PIPE_WAITED_COLOR, PIPE_HANDSHAKED_COLOR)
+from .heatmap import heat_color
+from .lod import low_detail
 from .theme import themify
 
 PIPE_STYLES = {
@@ -25,6 +28,23 @@ PIPE_SIM_STATUS_COLOR = {
 }
 
 
+@lru_cache(maxsize=256)
+def pipe_pen(color, width, style):
+    """Pens are shared between the pipes. Status colors come in only a handful
+    of combinations, but the heat map colors are not bounded, hence the least
+    recently used pens are dropped."""
+
+    if isinstance(color, tuple):
+        color = QtGui.QColor(*color)
+    else:
+        color = QtGui.QColor(color)
+
+    pen = QtGui.QPen(color, width)
+    pen.setStyle(PIPE_STYLES[style])
+    pen.setCapStyle(QtCore.Qt.RoundCap)
+    return pen
+
+
 class Pipe(QtWidgets.QGraphicsPathItem):
     """
     Base Pipe Item.
@@ -46,6 +66,11 @@ class Pipe(QtWidgets.QGraphicsPathItem):
         self._output_port = output_port
         self.model = model
         self.layout_path = []
+        self.polyline = QtGui.QPolygonF()
+        self._path = QtGui.QPainterPath()
+        self._shape = QtGui.QPainterPath()
+        self._bounding_rect = QtCore.QRectF()
+        self.heat = None
         self.set_status("empty")
         # self.set_tooltip()
 
@@ -64,11 +89,19 @@ class Pipe(QtWidgets.QGraphicsPathItem):
 
     def set_status(self, status):
         self.status = status
-        new_color = themify(PIPE_SIM_STATUS_COLOR[status])
+        if self.heat is None:
+            new_color = themify(PIPE_SIM_STATUS_COLOR[status])
+        else:
+            new_color = heat_color(self.heat)
+
         if new_color != self.color:
             self.color = new_color
             self.update()
 
+    def set_heat(self, heat):
+        self.heat = heat
+        self.set_status(self.status)
+
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
         # self.setFlag(self.ItemIsMovable, True)
@@ -82,28 +115,39 @@ class Pipe(QtWidgets.QGraphicsPathItem):
         if self.isSelected():
             self.highlight()
 
+    def boundingRect(self):
+        return self._bounding_rect
+
+    def shape(self):
+        return self._shape
+
+    def path(self):
+        return self._path
+
     def paint(self, painter, option, widget):
-        color = QtGui.QColor(self._color)
-        pen_style = PIPE_STYLES.get(self.style)
+        color = self._color
+        style = self.style
 
-        if self.status == 'empty':
+        if self.status == 'empty' and self.heat is None:
             pen_width = PIPE_WIDTH
         else:
             pen_width = PIPE_WIDTH * 3
 
         if self._active:
-            color = QtGui.QColor(*PIPE_HIGHLIGHT_COLOR)
+            color = PIPE_HIGHLIGHT_COLOR
         elif self.isSelected():
-            color = QtGui.QColor(*PIPE_HIGHLIGHT_COLOR)
-            pen_style = PIPE_STYLES.get(PIPE_STYLE_DEFAULT)
+            color = PIPE_HIGHLIGHT_COLOR
+            style = PIPE_STYLE_DEFAULT
 
-        pen = QtGui.QPen(color, pen_width)
-        pen.setStyle(pen_style)
-        pen.setCapStyle(QtCore.Qt.RoundCap)
+        if low_detail(painter, option):
+            # Cosmetic pen, one pixel wide regardless of the zoom
+            painter.setPen(pipe_pen(color, 0, PIPE_STYLE_DEFAULT))
+            painter.drawPolyline(self.polyline)
+            return
 
-        painter.setPen(pen)
+        painter.setPen(pipe_pen(color, pen_width, style))
         painter.setRenderHint(painter.Antialiasing, True)
-        painter.drawPath(self.path())
+        painter.drawPath(self._path)
 
     def spline(self, pos1, pos2, start=True):
         ctr_offset_x1, ctr_offset_x2 = pos1.x(), pos2.x()
@@ -135,13 +179,25 @@ class Pipe(QtWidgets.QGraphicsPathItem):
 
         path.lineTo(qp_start)
 
-        self.setPath(path)
+        self.prepareGeometryChange()
+
+        # Spline end points, drawn instead of the curves when zoomed out
+        self.polyline = QtGui.QPolygonF([qp_end] + self.layout_path[4::3] + [qp_start])
+
+        # Geometry is recalculated only here, when the layout changes. The
+        # shape is as wide as the widest pen, which covers the pipe in any
+        # of its states, so the color and status changes need only repaint
+        # the bounding rect
+        stroker = QtGui.QPainterPathStroker()
+        stroker.setWidth(PIPE_WIDTH * 3)
+        stroker.setCapStyle(QtCore.Qt.RoundCap)
+        self._path = path
+        self._shape = stroker.createStroke(path)
+        self._bounding_rect = self._shape.controlPointRect()
 
     def activate(self):
         self._active = True
-        pen = QtGui.QPen(QtGui.QColor(*PIPE_HIGHLIGHT_COLOR), 2)
-        pen.setStyle(PIPE_STYLES.get(PIPE_STYLE_DEFAULT))
-        self.setPen(pen)
+        self.update()
 
     def active(self):
         return self._active
@@ -155,9 +211,7 @@ class Pipe(QtWidgets.QGraphicsPathItem):
     def reset(self):
         self._active = False
         self._highlight = False
-        pen = QtGui.QPen(QtGui.QColor(self.color), 2)
-        pen.setStyle(PIPE_STYLES.get(self.style))
-        self.setPen(pen)
+        self.update()
 
     @property
     def input_port(self):
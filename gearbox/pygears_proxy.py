@@ -1,9 +1,13 @@
 import functools
+import heapq
 import logging
 import os
 import queue
 import runpy
+import subprocess
 import sys
+import threading
+import time
 
 from PySide2 import QtCore, QtWidgets
 
@@ -15,6 +19,8 @@ from pygears.sim.extens.sim_extend import SimExtend
 from pygears.sim.modules import SimVerilated
 
 from .node_model import find_cosim_modules
+from .trace_columnar import remove_compacted
+from .utils import module_env
 
 # from jinja2.debug import fake_exc_info
 
@@ -26,6 +32,9 @@ class EmptyHierarchy(Exception):
 class Gearbox(QtCore.QObject, SimExtend):
     sim_event = QtCore.Signal(str)
 
+    # Trace compaction of the previous run, which may outlive its simulation
+    compaction = None
+
     def __init__(self,
                  live=True,
                  reload=True,
@@ -42,6 +51,12 @@ class Gearbox(QtCore.QObject, SimExtend):
         #     self.queue = queue.Queue()
 
         self.breakpoints = set()
+        self.break_timesteps = []
+        self.timestep = None
+        self.fast_run = reg['gearbox/sim/fast_run']
+        self.heartbeat_period = reg['gearbox/sim/heartbeat']
+        self.heartbeat_next = 0
+        self.heartbeat_pending = False
         self.live = live
         self.done = False
         self.reload = reload
@@ -57,8 +72,18 @@ class Gearbox(QtCore.QObject, SimExtend):
         SimExtend.__init__(self)
         return self
 
+    def break_at(self, timestep):
+        heapq.heappush(self.break_timesteps, timestep)
+
     def _should_break(self):
         triggered = False
+        while self.break_timesteps and self.break_timesteps[0] <= self.timestep:
+            heapq.heappop(self.break_timesteps)
+            triggered = True
+
+        if not self.breakpoints:
+            return triggered
+
         discard = []
 
         for b in self.breakpoints:
@@ -94,12 +119,15 @@ class Gearbox(QtCore.QObject, SimExtend):
             self.loop.exec_()
             self.running = True
         else:
-            # print("Here?")
-            QtCore.QThread.yieldCurrentThread()
-            QtCore.QThread.currentThread().usleep(10)
-            # QtCore.QThread.currentThreadId().msleep(10)
-            # Let GUI thread do some work
-            # time.sleep(0.0001)
+            self._heartbeat()
+
+            if not self.fast_run:
+                # print("Here?")
+                QtCore.QThread.yieldCurrentThread()
+                QtCore.QThread.currentThread().usleep(10)
+                # QtCore.QThread.currentThreadId().msleep(10)
+                # Let GUI thread do some work
+                # time.sleep(0.0001)
 
         # print('Back to the simulator')
 
@@ -107,6 +135,21 @@ class Gearbox(QtCore.QObject, SimExtend):
             raise SimFinish
             # sys.exit(0)
 
+    def _heartbeat(self):
+        # GUI is refreshed periodically in wall-clock time, regardless of how
+        # fast the timesteps go by. The next heartbeat is not sent before the
+        # GUI has handled the previous one, so that a slow GUI is not flooded
+        if self.heartbeat_pending:
+            return
+
+        now = time.monotonic()
+        if now < self.heartbeat_next:
+            return
+
+        self.heartbeat_next = now + self.heartbeat_period
+        self.heartbeat_pending = True
+        self.sim_event.emit('heartbeat')
+
     def before_run(self, sim):
         # Gearbox has to be last of all plugins to receive 'after_timestep'
         # event, so that for an example VCD plugin finished flushing waveforms
@@ -115,18 +158,62 @@ class Gearbox(QtCore.QObject, SimExtend):
         del e[i]
         e.append(self.after_timestep)
 
+        # Compacted traces left from the previous run would shadow the new ones
+        if Gearbox.compaction is not None:
+            Gearbox.compaction.wait()
+            Gearbox.compaction = None
+
+        for trace_fn in self.trace_fns():
+            remove_compacted(trace_fn)
+
         self.handle_event('before_run')
 
     # def at_exit(self, sim):
     #     self.handle_event('at_exit')
 
     def after_timestep(self, sim, timestep):
+        self.timestep = timestep
         self.handle_event('after_timestep')
         return True
 
     def after_cleanup(self, sim):
+        if reg['gearbox/trace/compact']:
+            # Traces streamed through a FIFO were never stored
+            trace_fns = [fn for fn in self.trace_fns() if os.path.isfile(fn)]
+            if trace_fns:
+                self.compact_traces(trace_fns, reg['gearbox/trace/keep_vcd'])
+
         self.handle_event('after_cleanup')
 
+    def compact_traces(self, trace_fns, keep_vcd):
+        # Compaction runs in its own process, which cleans up after itself
+        # even if gearbox exits meanwhile
+        cmd = [sys.executable, '-m', 'gearbox.trace_columnar']
+        if not keep_vcd:
+            cmd.append('--remove-vcd')
+
+        Gearbox.compaction = subprocess.Popen(cmd + trace_fns, env=module_env())
+        threading.Thread(target=self.traces_compacted,
+                         args=(Gearbox.compaction, ),
+                         daemon=True).start()
+
+    def traces_compacted(self, proc):
+        if proc.wait() != 0:
+            print(f'Trace compaction failed with code {proc.returncode}')
+
+        self.sim_event.emit('traces_compacted')
+
+    def trace_fns(self):
+        traces = []
+        try:
+            traces.append(reg['VCD'])
+        except KeyError:
+            pass
+
+        traces.extend(m for m in find_cosim_modules() if isinstance(m, SimVerilated))
+
+        return [t.trace_fn for t in traces if t.trace_fn]
+
     def before_setup(self, sim):
         # Gearbox has to be last of all plugins to receive 'after_timestep'
         # event, so that for an example VCD plugin finished flushing waveforms
@@ -135,6 +222,12 @@ class Gearbox(QtCore.QObject, SimExtend):
         del e[i]
         e.append(self.before_run)
 
+        # Traces are compacted only after all the other plugins have closed them
+        e = sim.events['after_cleanup']
+        i = e.index(self.after_cleanup)
+        del e[i]
+        e.append(self.after_cleanup)
+
         if self.live:
             for m in find_cosim_modules():
                 if isinstance(m, SimVerilated):
@@ -214,6 +307,8 @@ class PyGearsClient(QtCore.QObject):
     # These are called automatically by handle_event
     after_cleanup = QtCore.Signal()
     after_timestep = QtCore.Signal()
+    heartbeat = QtCore.Signal()
+    traces_compacted = QtCore.Signal()
     at_exit = QtCore.Signal()
 
     @inject
@@ -250,6 +345,13 @@ class PyGearsClient(QtCore.QObject):
     def breakpoint(self, func):
         self.pygears_proc.breakpoints.add(func)
 
+    def break_at(self, timestep):
+        self.pygears_proc.break_at(timestep)
+
+    def heartbeat_done(self):
+        if self.pygears_proc:
+            self.pygears_proc.heartbeat_pending = False
+
     def start_thread(self):
         self.thrd = QtCore.QThread()
         reg['gearbox/main/threads'].add(self.thrd)
@@ -441,3 +543,9 @@ class MainWindowPlugin(PluginBase):
     def bind(cls):
         reg['gearbox/model_script_name'] = None
         reg['gearbox/compilation_log_fn'] = None
+        # Run the simulation between the breakpoints without yielding to the
+        # GUI thread on every timestep
+        reg.confdef('gearbox/sim/fast_run', default=False)
+        # Minimal period in seconds between the GUI refreshes while the
+        # simulation is running
+        reg.confdef('gearbox/sim/heartbeat', default=0.1)
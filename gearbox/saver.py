@@ -119,7 +119,7 @@ def load_str_template(template):
 
 class GraphStatusSaver(HierYielderBase):
     def NodeModel(self, node):
-        if not node.view.collapsed and bool(node.name):
+        if node.expanded and bool(node.name):
             yield node.name[1:]
 
 
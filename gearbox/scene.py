@@ -4,6 +4,8 @@ from pygears.conf import Inject, inject, reg
 
 from .theme import ThemePlugin
 
+GRID_SIZE = 20
+
 
 class NodeScene(QtWidgets.QGraphicsScene):
     @inject
@@ -15,6 +17,7 @@ class NodeScene(QtWidgets.QGraphicsScene):
         self.background_color = QtGui.QColor(background_color)
         self.grid_color = grid_color
         self.grid = True
+        self.grid_tiles = {}
 
     def __repr__(self):
         return '{}.{}(\'{}\')'.format(self.__module__, self.__class__.__name__,
@@ -35,40 +38,58 @@ class NodeScene(QtWidgets.QGraphicsScene):
         painter.setPen(pen)
         painter.drawLines(lines)
 
-    def drawBackground(self, painter, rect):
-        painter.save()
+    def _grid_tile(self, zoom):
+        # One period of the coarse grid, rendered at the resolution of the
+        # current zoom level, so that it can be tiled without scaling
+        grid_size = GRID_SIZE
+        tile_size = grid_size * 8
+        scale = zoom + 1.0
+        pixels = max(1, round(tile_size * scale))
 
-        # bg_color = QtGui.QColor(*self._bg_color)
-        bg_color = self.background_color
-        painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
-        painter.setBrush(bg_color)
-        painter.drawRect(rect)
+        tile = QtGui.QPixmap(pixels, pixels)
+        tile.fill(self.background_color)
 
-        if not self.grid:
-            return
-
-        zoom = self.viewer().get_zoom()
-        grid_size = 20
+        painter = QtGui.QPainter(tile)
+        painter.scale(pixels / tile_size, pixels / tile_size)
+        rect = QtCore.QRectF(0, 0, tile_size, tile_size)
 
         if zoom > -0.5:
             pen = QtGui.QPen(QtGui.QColor(self.grid_color), 0.65)
-            self._draw_grid(painter, rect, pen, grid_size)
+            self._draw_grid(painter, rect.adjusted(-grid_size, -grid_size, 0, 0), pen,
+                            grid_size)
 
-        color = bg_color.darker(300)
+        color = self.background_color.darker(300)
         if zoom < -0.0:
             color = color.darker(100 - int(zoom * 110))
         pen = QtGui.QPen(color, 0.65)
-        self._draw_grid(painter, rect, pen, grid_size * 8)
-
-        # fix border issue on the scene edge.
-        pen = QtGui.QPen(bg_color, 1)
-        pen.setCosmetic(True)
-        path = QtGui.QPainterPath()
-        path.addRect(rect)
-        painter.setBrush(QtCore.Qt.NoBrush)
-        painter.setPen(pen)
-        painter.drawPath(path)
+        self._draw_grid(painter, rect.adjusted(-tile_size, -tile_size, 0, 0), pen, tile_size)
+        painter.end()
+
+        return tile
 
+    def drawBackground(self, painter, rect):
+        if not self.grid:
+            painter.fillRect(rect, self.background_color)
+            return
+
+        zoom = self.viewer().get_zoom()
+        # Colors are part of the key, so that the theme changes are picked up
+        key = (zoom, self.background_color.rgba(), QtGui.QColor(self.grid_color).rgba())
+        tile = self.grid_tiles.get(key, None)
+        if tile is None:
+            if len(self.grid_tiles) > 64:
+                self.grid_tiles.clear()
+
+            tile = self.grid_tiles[key] = self._grid_tile(zoom)
+
+        # Draw in the tile pixels, so that the tile is painted almost 1:1
+        scale = tile.width() / (GRID_SIZE * 8)
+        painter.save()
+        painter.scale(1 / scale, 1 / scale)
+        rect = QtCore.QRectF(rect.left() * scale, rect.top() * scale, rect.width() * scale,
+                             rect.height() * scale)
+        painter.drawTiledPixmap(
+            rect, tile, QtCore.QPointF(rect.left() % tile.width(), rect.top() % tile.height()))
         painter.restore()
 
     def viewer(self):
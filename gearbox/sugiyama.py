@@ -0,0 +1,447 @@
+import numpy as np
+
+# Spacing between the layers and between the nodes within a layer, matching
+# the dot defaults of 0.5 and 0.25 inches
+RANKSEP = 36.0
+NODESEP = 18.0
+
+# Minimized nodes are drawn as small circles
+MINIMIZED_SIZE = 10.0
+
+# Size of the node's own input and output ports
+PORT_SIZE = 1.0
+
+# Number of the crossing minimisation and the coordinate refinement passes
+ORDER_SWEEPS = 8
+PLACE_SWEEPS = 8
+
+
+class Vertex:
+    def __init__(self, name, width, height, inputs=(), outputs=()):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.inputs = inputs
+        self.outputs = outputs
+        self.layer = 0
+        self.order = 0
+        self.x = 0.0
+        self.y = 0.0
+
+    def port_offset(self, port):
+        """Distance of the port from the top of the vertex."""
+        if port and port[0] == 'i' and self.inputs:
+            return self.inputs[int(port[1:])]
+
+        if port and port[0] == 'o' and self.outputs:
+            return self.outputs[int(port[1:])]
+
+        return self.height / 2
+
+
+class Segment:
+    """Part of an edge between the vertices in adjacent layers."""
+
+    def __init__(self, tail, tailport, head, headport):
+        self.tail = tail
+        self.tailport = tailport
+        self.head = head
+        self.headport = headport
+
+    def tail_y(self):
+        return self.tail.y + self.tail.port_offset(self.tailport)
+
+    def head_y(self):
+        return self.head.y + self.head.port_offset(self.headport)
+
+
+def build_vertices(desc):
+    vertices = {}
+
+    for i in range(desc['inputs']):
+        vertices[f'i{i}'] = Vertex(f'i{i}', PORT_SIZE, PORT_SIZE)
+
+    for i in range(desc['outputs']):
+        vertices[f'o{i}'] = Vertex(f'o{i}', PORT_SIZE, PORT_SIZE)
+
+    for i, node in enumerate(desc['nodes']):
+        if node is None:
+            vertices[f'n{i}'] = Vertex(f'n{i}', MINIMIZED_SIZE, MINIMIZED_SIZE)
+        else:
+            width, height = node['size']
+            vertices[f'n{i}'] = Vertex(f'n{i}', width, height, node['inputs'],
+                                       node['outputs'])
+
+    return vertices
+
+
+def break_cycles(names, edges):
+    """Returns the set of edge indices that close a cycle, found by the depth
+    first search from the graph inputs in the order of the description."""
+
+    succ = {name: [] for name in names}
+    for i, (tail, _, head, _) in enumerate(edges):
+        if tail != head:
+            succ[tail].append((head, i))
+
+    state = dict.fromkeys(names, 0)
+    reversed_edges = set()
+
+    for root in names:
+        if state[root]:
+            continue
+
+        state[root] = 1
+        stack = [(root, iter(succ[root]))]
+        while stack:
+            name, it = stack[-1]
+            for head, i in it:
+                if state[head] == 1:
+                    reversed_edges.add(i)
+                elif state[head] == 0:
+                    state[head] = 1
+                    stack.append((head, iter(succ[head])))
+                    break
+            else:
+                state[name] = 2
+                stack.pop()
+
+    return reversed_edges
+
+
+def assign_layers(vertices, links):
+    """Longest path layering with the graph inputs in the first and the graph
+    outputs in the last layer. Nodes are afterwards pulled towards their
+    successors to shorten the edges."""
+
+    pred = {name: [] for name in vertices}
+    succ = {name: [] for name in vertices}
+    for tail, head in links:
+        pred[head].append(tail)
+        succ[tail].append(head)
+
+    indeg = {name: len(pred[name]) for name in vertices}
+    ready = [name for name in vertices if indeg[name] == 0]
+    topo = []
+    while ready:
+        name = ready.pop()
+        topo.append(name)
+        for head in succ[name]:
+            indeg[head] -= 1
+            if indeg[head] == 0:
+                ready.append(head)
+
+    layer = {}
+    for name in topo:
+        if name[0] == 'i':
+            layer[name] = 0
+        else:
+            layer[name] = max((layer[t] + 1 for t in pred[name]), default=1)
+
+    inner = [name for name in topo if name[0] == 'n']
+    last = max((layer[name] for name in inner), default=0) + 1
+
+    for name in reversed(inner):
+        heads = [layer[h] for h in succ[name] if h[0] == 'n']
+        if heads:
+            layer[name] = max(layer[name], min(heads) - 1)
+        elif succ[name]:
+            # Feeds only the graph outputs
+            layer[name] = max(layer[name], last - 1)
+
+    for name, v in vertices.items():
+        v.layer = last if name[0] == 'o' else layer[name]
+
+    return last + 1
+
+
+def split_edges(vertices, edges, reversed_edges, num_layers):
+    """Splits the edges into segments between the adjacent layers, inserting
+    a dummy vertex in each layer that an edge crosses. Returns the layers, the
+    segments and for each edge its chain of vertices from tail to head."""
+
+    layers = [[] for _ in range(num_layers)]
+    for v in vertices.values():
+        layers[v.layer].append(v)
+
+    segments = []
+    chains = []
+    for i, (tail, tailport, head, headport) in enumerate(edges):
+        tail, head = vertices[tail], vertices[head]
+        if tail is head:
+            chains.append(None)
+            continue
+
+        src, srcport, dst, dstport = tail, tailport, head, headport
+        if i in reversed_edges:
+            src, srcport, dst, dstport = head, headport, tail, tailport
+
+        chain = [src]
+        for layer in range(src.layer + 1, dst.layer):
+            dummy = Vertex(None, 0.0, 0.0)
+            dummy.layer = layer
+            layers[layer].append(dummy)
+            chain.append(dummy)
+
+        chain.append(dst)
+
+        for j, (t, h) in enumerate(zip(chain, chain[1:])):
+            segments.append(
+                Segment(t, srcport if j == 0 else '', h,
+                        dstport if j == len(chain) - 2 else ''))
+
+        if i in reversed_edges:
+            chain.reverse()
+
+        chains.append(chain)
+
+    return layers, segments, chains
+
+
+def port_rank(v, port):
+    # Position of the port along the layer, so that the edges attached to the
+    # same vertex are ordered by their ports
+    if v.height:
+        return v.order + v.port_offset(port) / v.height - 0.5
+
+    return v.order
+
+
+def count_crossings(layers, down):
+    crossings = 0
+    for layer in range(len(layers) - 1):
+        segs = down[layer]
+        if len(segs) < 2:
+            continue
+
+        top = np.array([port_rank(s.tail, s.tailport) for s in segs])
+        bottom = np.array([port_rank(s.head, s.headport) for s in segs])
+
+        crossings += int(
+            np.count_nonzero((top[:, None] < top[None, :]) & (bottom[:, None] > bottom[None, :])))
+
+    return crossings
+
+
+def order_layer(layer, segs, fixed_side):
+    # Barycenter of the neighbours in the fixed layer, vertices without any
+    # keep their current position
+    bary = {}
+    for s in segs:
+        if fixed_side == 'tail':
+            v, r = s.head, port_rank(s.tail, s.tailport)
+        else:
+            v, r = s.tail, port_rank(s.head, s.headport)
+
+        total, count = bary.get(v, (0.0, 0))
+        bary[v] = (total + r, count + 1)
+
+    def key(v):
+        if v in bary:
+            total, count = bary[v]
+            return total / count
+
+        return v.order
+
+    layer.sort(key=key)
+    for i, v in enumerate(layer):
+        v.order = i
+
+
+def minimize_crossings(layers, segments):
+    down = [[] for _ in layers]
+    up = [[] for _ in layers]
+    for s in segments:
+        down[s.tail.layer].append(s)
+        up[s.head.layer].append(s)
+
+    for layer in layers:
+        for i, v in enumerate(layer):
+            v.order = i
+
+    best = [list(layer) for layer in layers]
+    best_crossings = count_crossings(layers, down)
+
+    for sweep in range(ORDER_SWEEPS):
+        if best_crossings == 0:
+            break
+
+        if sweep % 2 == 0:
+            for i in range(1, len(layers)):
+                order_layer(layers[i], up[i], 'tail')
+        else:
+            for i in range(len(layers) - 2, -1, -1):
+                order_layer(layers[i], down[i], 'head')
+
+        crossings = count_crossings(layers, down)
+        if crossings < best_crossings:
+            best = [list(layer) for layer in layers]
+            best_crossings = crossings
+
+    for layer, order in zip(layers, best):
+        layer[:] = order
+        for i, v in enumerate(layer):
+            v.order = i
+
+    return down, up
+
+
+def pack(desired, heights):
+    """Returns the vertex tops closest to the desired ones in the least squares
+    sense, that keep the vertex order and the separation between them.
+
+    Shifting each top by the total extent of the preceding vertices turns the
+    problem into an isotonic regression, solved by pooling adjacent violators.
+    """
+
+    extent = np.concatenate(([0.0], np.cumsum(heights + NODESEP)[:-1]))
+    target = desired - extent
+
+    blocks = []
+    for value in target:
+        blocks.append([value, 1])
+        while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+            value, count = blocks.pop()
+            prev = blocks[-1]
+            prev[0] = (prev[0] * prev[1] + value * count) / (prev[1] + count)
+            prev[1] += count
+
+    fitted = np.concatenate([np.full(count, value) for value, count in blocks])
+    return fitted + extent
+
+
+def place_layer(layer, segs_up, segs_down):
+    desired = []
+    for v in layer:
+        targets = [s.tail_y() - v.port_offset(s.headport) for s in segs_up.get(v, ())]
+        targets += [s.head_y() - v.port_offset(s.tailport) for s in segs_down.get(v, ())]
+        desired.append(sum(targets) / len(targets) if targets else v.y)
+
+    heights = np.array([v.height for v in layer], dtype=float)
+    for v, y in zip(layer, pack(np.array(desired), heights)):
+        v.y = float(y)
+
+
+def assign_coordinates(layers, down, up):
+    x = 0.0
+    for layer in layers:
+        width = max((v.width for v in layer), default=0.0)
+        for v in layer:
+            v.x = x + width / 2
+
+        x += width + RANKSEP
+
+    for layer in layers:
+        y = 0.0
+        for v in layer:
+            v.y = y
+            y += v.height + NODESEP
+
+    segs_up = [{} for _ in layers]
+    segs_down = [{} for _ in layers]
+    for i in range(len(layers)):
+        for s in up[i]:
+            segs_up[i].setdefault(s.head, []).append(s)
+        for s in down[i]:
+            segs_down[i].setdefault(s.tail, []).append(s)
+
+    # Pull the vertices towards their neighbours to straighten the edges,
+    # alternating between the left-to-right and right-to-left sweeps where
+    # each layer is aligned only to the previously placed one, and the
+    # sweeps that balance between both neighbouring layers
+    for sweep in range(PLACE_SWEEPS):
+        if sweep % 3 == 0:
+            for i in range(1, len(layers)):
+                place_layer(layers[i], segs_up[i], {})
+        elif sweep % 3 == 1:
+            for i in range(len(layers) - 2, -1, -1):
+                place_layer(layers[i], {}, segs_down[i])
+        else:
+            for i in range(len(layers)):
+                place_layer(layers[i], segs_up[i], segs_down[i])
+
+
+def route_self_loop(v, tailport, headport):
+    start = (v.x + v.width / 2, v.y + v.port_offset(tailport))
+    end = (v.x - v.width / 2, v.y + v.port_offset(headport))
+    top = v.y - RANKSEP / 2
+    right = (start[0] + RANKSEP / 2, top)
+    left = (end[0] - RANKSEP / 2, top)
+
+    return [start, right, left, end], [1, -1, -1, 1]
+
+
+def route_chain(chain, tailport, headport):
+    tail, head = chain[0], chain[-1]
+    points = [(tail.x + tail.width / 2, tail.y + tail.port_offset(tailport))]
+    points.extend((v.x, v.y) for v in chain[1:-1])
+    points.append((head.x - head.width / 2, head.y + head.port_offset(headport)))
+
+    # Edges leave the output ports and enter the input ports horizontally from
+    # the left, while the dummy vertices of the edges closing a cycle are
+    # passed from right to left
+    backward = tail.layer > head.layer
+    directions = [1] + [-1 if backward else 1] * (len(points) - 2) + [1]
+
+    return points, directions
+
+
+def spline(points, directions):
+    """Cubic Bezier segments through the points, with horizontal tangents."""
+
+    path = [points[0]]
+    for (p0, d0), (p1, d1) in zip(zip(points, directions), zip(points[1:], directions[1:])):
+        handle = max(abs(p1[0] - p0[0]) / 2, RANKSEP / 2)
+        path.append((p0[0] + d0 * handle, p0[1]))
+        path.append((p1[0] - d1 * handle, p1[1]))
+        path.append(p1)
+
+    return path
+
+
+def run_sugiyama(desc, external=False):
+    """Lays out a hierarchical node with the layered graph drawing method.
+
+    Takes the same layout description and returns the geometry in the same
+    format as :func:`gearbox.layout_engine.run_dot`. The layout runs entirely in
+    Python, hence external is ignored.
+    """
+
+    vertices = build_vertices(desc)
+    edges = desc['edges']
+
+    reversed_edges = break_cycles(list(vertices), edges)
+    links = []
+    for i, (tail, _, head, _) in enumerate(edges):
+        if tail != head:
+            links.append((head, tail) if i in reversed_edges else (tail, head))
+
+    num_layers = assign_layers(vertices, links)
+    layers, segments, chains = split_edges(vertices, edges, reversed_edges, num_layers)
+    down, up = minimize_crossings(layers, segments)
+    assign_coordinates(layers, down, up)
+
+    routes = []
+    for chain, (tail, tailport, head, headport) in zip(chains, edges):
+        if chain is None:
+            routes.append(route_self_loop(vertices[tail], tailport, headport))
+        else:
+            routes.append(route_chain(chain, tailport, headport))
+
+    def center(v):
+        return [v.x, -(v.y + v.height / 2)]
+
+    def flip(point):
+        return [point[0], -point[1]]
+
+    edge_paths = []
+    for points, directions in routes:
+        path = spline(points, directions)
+        edge_paths.append([flip(points[-1])] + [flip(p) for p in path])
+
+    return {
+        'nodes': [center(vertices[f'n{i}']) for i in range(len(desc['nodes']))],
+        'inputs': [center(vertices[f'i{i}']) for i in range(desc['inputs'])],
+        'outputs': [center(vertices[f'o{i}']) for i in range(desc['outputs'])],
+        'edges': edge_paths
+    }
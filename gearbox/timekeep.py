@@ -37,48 +37,38 @@ class TimeKeep(QtCore.QObject):
     def __init__(self, sim_bridge=Inject('gearbox/sim_bridge')):
         super().__init__()
         self._timestep = None
-        self._time_target = None
         reg['gearbox/timestep'] = self.max_timestep
         sim_bridge.after_timestep.connect(self.sim_break)
         sim_bridge.after_cleanup.connect(self.sim_break)
+        sim_bridge.heartbeat.connect(self.heartbeat)
         sim_bridge.model_closed.connect(self.model_closed)
         sim_bridge.script_loaded.connect(self.model_loaded)
 
     def model_loaded(self):
         self._timestep = None
-        self._time_target = None
         self.timestep_changed.emit(self._timestep)
 
     def model_closed(self):
         self._timestep = None
-        self._time_target = None
 
     def sim_break(self):
         self.timestep = self.max_timestep
 
+    @inject
+    def heartbeat(self, sim_bridge=Inject('gearbox/sim_bridge')):
+        self.timestep = self.max_timestep
+        sim_bridge.heartbeat_done()
+
     @property
     def timestep(self):
         return self._timestep
 
-    def break_on_timestep(self):
-        if self._timestep is None:
-            self._timestep = 0
-
-        if self.max_timestep >= self._timestep + reg['gearbox/refresh-rate']:
-            self.timestep = self.max_timestep
-
-        if self.max_timestep == self._time_target:
-            return True, False
-        else:
-            return False, True
-
     @timestep.setter
     @inject
     def timestep(self, val, sim_bridge=Inject('gearbox/sim_bridge')):
         if (self.max_timestep is None) or (val > self.max_timestep):
-            self._time_target = val
             self._timestep = self.max_timestep
-            sim_bridge.breakpoint(self.break_on_timestep)
+            sim_bridge.break_at(val)
             if not sim_bridge.running:
                 sim_bridge.cont()
         else:
@@ -0,0 +1,325 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import traceback
+from array import array
+
+from pygears.conf import PluginBase, reg
+
+from .vcd_index import VCDSignal, VCDTailer
+
+MAGIC = b'GBTRACE\x01'
+HEADER_LEN = struct.Struct('<Q')
+
+# Limits how much of the VCD is decoded at once while compacting
+COMPACT_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def columnar_trace_fn(trace_fn):
+    return os.path.splitext(trace_fn)[0] + '.gbt'
+
+
+def fst_trace_fn(trace_fn):
+    return os.path.splitext(trace_fn)[0] + '.fst'
+
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+
+class ColumnarWriter:
+    """Writes a gearbox columnar trace from a VCD index that is decoded in
+    chunks.
+
+    After each chunk, the decoded value changes are moved out of the index
+    into per-signal spool files, so that the memory use depends only on the
+    chunk size and not on the trace length. The spools are then joined into
+    the final file, in which each signal is stored as a column of change
+    times, followed by the offsets of its values within the value blob,
+    followed by the blob itself. All sections are 8-byte aligned so that the
+    reader can map them directly.
+    """
+
+    def __init__(self, index, spool_dir):
+        self.index = index
+        self.spool_dir = spool_dir
+        # Number of changes and value blob size of each spooled signal
+        self.sizes = {}
+
+    def _spool_fn(self, code, kind):
+        # Signal codes may hold any printable character, so name the files
+        # after their ordinal numbers
+        return os.path.join(self.spool_dir, f'{self.columns[code]}.{kind}')
+
+    def spool(self, final=False):
+        """Moves the decoded value changes from the index to the spools.
+
+        The last change of each signal is kept in the index unless final is
+        set, since a change at the same time in the next chunk overwrites it.
+        """
+
+        self.columns = {code: i for i, code in enumerate(self.index.signals)}
+
+        for code, sig in self.index.signals.items():
+            count = len(sig.times) if final else len(sig.times) - 1
+            if count <= 0:
+                continue
+
+            values = [v.encode() for v in sig.values[:count]]
+            lengths = array('Q', map(len, values))
+
+            with open(self._spool_fn(code, 'times'), 'ab') as f:
+                sig.times[:count].tofile(f)
+
+            with open(self._spool_fn(code, 'lengths'), 'ab') as f:
+                lengths.tofile(f)
+
+            with open(self._spool_fn(code, 'blob'), 'ab') as f:
+                f.write(b''.join(values))
+
+            n, blob_size = self.sizes.get(code, (0, 0))
+            self.sizes[code] = (n + count, blob_size + sum(lengths))
+
+            del sig.times[:count]
+            del sig.values[:count]
+
+    def write(self, fn):
+        self.spool(final=True)
+
+        header = {
+            'byteorder': sys.byteorder,
+            'end_time': self.index.end_time,
+            'names': {name: self.columns[code]
+                      for name, code in self.index.names.items()},
+            'columns': [],
+        }
+
+        # Section offsets depend on the header length, so lay the sections out
+        # relative to the data start first
+        pos = 0
+        for code in self.index.signals:
+            n, blob_size = self.sizes.get(code, (0, 0))
+            col = [n, pos]
+            pos += n * 8
+            col.append(pos)
+            pos += (n + 1) * 8
+            col.append(pos)
+            pos += blob_size + (-blob_size % 8)
+            header['columns'].append(col)
+
+        header = json.dumps(header).encode()
+        data_start = len(MAGIC) + HEADER_LEN.size + len(header)
+        data_start += -data_start % 8
+
+        with open(fn, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER_LEN.pack(len(header)))
+            f.write(header)
+            _pad(f)
+            assert f.tell() == data_start
+
+            for code in self.index.signals:
+                self._copy(code, 'times', f)
+                self._write_offsets(code, f)
+                self._copy(code, 'blob', f)
+                _pad(f)
+
+        return data_start
+
+    def _copy(self, code, kind, f):
+        if code in self.sizes:
+            with open(self._spool_fn(code, kind), 'rb') as spool:
+                shutil.copyfileobj(spool, f)
+
+    def _write_offsets(self, code, f):
+        offset = 0
+        array('Q', [offset]).tofile(f)
+        if code not in self.sizes:
+            return
+
+        with open(self._spool_fn(code, 'lengths'), 'rb') as spool:
+            while True:
+                lengths = array('Q')
+                lengths.frombytes(spool.read(COMPACT_CHUNK_SIZE // 8 * 8))
+                if not lengths:
+                    break
+
+                offsets = array('Q')
+                for length in lengths:
+                    offset += length
+                    offsets.append(offset)
+
+                offsets.tofile(f)
+
+
+def write_columnar(index, fn):
+    """Writes a VCD index as a gearbox columnar trace."""
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(fn) or None) as spool_dir:
+        return ColumnarWriter(index, spool_dir).write(fn)
+
+
+class ColumnarValues:
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+
+class ColumnarSignal(VCDSignal):
+    def __init__(self, code, times, values):
+        self.code = code
+        self.times = times
+        self.values = values
+        self.revision = 0
+
+
+class ColumnarTrace:
+    """Reader for traces written by :func:`write_columnar`.
+
+    The file is memory mapped and columns are read lazily, so opening a trace
+    costs only the header, and looking up a value at some time is a binary
+    search over the mapped change times.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Not a gearbox trace: {fn}')
+
+        header_len, = HEADER_LEN.unpack_from(self.mm, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LEN.size
+        header = json.loads(self.mm[header_start:header_start + header_len])
+
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f'Gearbox trace {fn} has foreign byte order')
+
+        data_start = header_start + header_len
+        self.data = memoryview(self.mm)[data_start + (-data_start % 8):]
+        self.names = header['names']
+        self.columns = header['columns']
+        self.end_time = header['end_time']
+        self.signals = {}
+        # Views into the map, the map can only be closed once they are all
+        # released
+        self.views = []
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def signal(self, name):
+        col = self.names[name]
+        if col not in self.signals:
+            n, times, offsets, blob = self.columns[col]
+            offsets = self.data[offsets:offsets + (n + 1) * 8].cast('Q')
+            times = self.data[times:times + n * 8].cast('Q')
+            blob = self.data[blob:blob + offsets[n]]
+            self.views.extend((offsets, times, blob))
+            self.signals[col] = ColumnarSignal(col, times, ColumnarValues(offsets, blob))
+
+        return self.signals[col]
+
+    def value_at(self, name, time, default=None):
+        try:
+            sig = self.signal(name)
+        except KeyError:
+            return default
+
+        return sig.value_at(time, default)
+
+    def close(self):
+        for view in self.views:
+            view.release()
+
+        self.views.clear()
+        self.signals.clear()
+        self.data.release()
+        self.mm.close()
+
+
+def spool_prefix(trace_fn):
+    return columnar_trace_fn(trace_fn) + '.spool.'
+
+
+def remove_compacted(trace_fn):
+    for fn in (columnar_trace_fn(trace_fn), fst_trace_fn(trace_fn)):
+        if os.path.exists(fn):
+            os.remove(fn)
+
+    # Spools left by the compactions that were killed midway
+    for spool_dir in glob.glob(glob.escape(spool_prefix(trace_fn)) + '*'):
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def compact_trace(trace_fn, keep_vcd=True):
+    """Converts a finished VCD trace into its compact forms.
+
+    A gearbox columnar trace is written for the status lookup, and if gtkwave's
+    vcd2fst tool is available, an FST file is written for the wave viewer.
+    """
+
+    columnar_fn = columnar_trace_fn(trace_fn)
+    tailer = VCDTailer(trace_fn)
+
+    # The trace is written under a temporary name, so that the readers never
+    # see a partially written one
+    spool_fn = spool_prefix(trace_fn)
+    with tempfile.TemporaryDirectory(prefix=os.path.basename(spool_fn),
+                                     dir=os.path.dirname(spool_fn) or None) as spool_dir:
+        writer = ColumnarWriter(tailer.index, spool_dir)
+        while tailer.poll(COMPACT_CHUNK_SIZE):
+            writer.spool()
+
+        partial_fn = os.path.join(spool_dir, 'trace.gbt')
+        writer.write(partial_fn)
+        os.replace(partial_fn, columnar_fn)
+
+    fst_written = False
+    if shutil.which('vcd2fst'):
+        fst_written = (subprocess.call(
+            ['vcd2fst', trace_fn, fst_trace_fn(trace_fn)],
+            stdout=subprocess.DEVNULL) == 0)
+
+    if fst_written and not keep_vcd:
+        os.remove(trace_fn)
+
+
+class TraceColumnarPlugin(PluginBase):
+    @classmethod
+    def bind(cls):
+        reg.confdef('gearbox/trace/compact', default=False)
+        reg.confdef('gearbox/trace/keep_vcd', default=True)
+
+
+if __name__ == '__main__':
+    # Gearbox runs the compaction as a separate process, so that decoding the
+    # trace does not hold the interpreter lock against the GUI
+    parser = argparse.ArgumentParser(description='Compacts finished VCD traces')
+    parser.add_argument('--remove-vcd', action='store_true')
+    parser.add_argument('trace_fns', nargs='+')
+    args = parser.parse_args()
+
+    failed = False
+    for trace_fn in args.trace_fns:
+        try:
+            compact_trace(trace_fn, keep_vcd=not args.remove_vcd)
+        except Exception:
+            traceback.print_exc()
+            failed = True
+
+    sys.exit(failed)
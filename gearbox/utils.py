@@ -1,3 +1,5 @@
+import os
+
 from pygears.conf import Inject, inject_async
 
 
@@ -19,3 +21,16 @@ def trigger(obj, signal):
         return waiter
 
     return wrapper
+
+
+def module_env():
+    """Environment for running a gearbox module as "python -m" in a child
+    process, which finds gearbox even if it is run from a source checkout."""
+
+    env = dict(os.environ)
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if env.get('PYTHONPATH'):
+        path = os.pathsep.join([path, env['PYTHONPATH']])
+
+    env['PYTHONPATH'] = path
+    return env
@@ -0,0 +1,220 @@
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+
+
+class VCDSignal:
+    def __init__(self, code):
+        self.code = code
+        self.times = array('Q')
+        self.values = []
+        # Counts all the changes, including the ones that overwrite the last
+        # value in place, so that the readers can tell when to refresh
+        self.revision = 0
+
+    def change(self, time, val):
+        self.revision += 1
+        if self.times and self.times[-1] == time:
+            self.values[-1] = val
+        else:
+            self.times.append(time)
+            self.values.append(val)
+
+    def value_at(self, time, default=None):
+        i = bisect_right(self.times, time)
+        if i == 0:
+            return default
+
+        return self.values[i - 1]
+
+
+class VCDIndex:
+    """In-process index of a VCD trace.
+
+    Value changes are kept per signal as sorted arrays of change times, so that
+    the value of any signal at any time is found with a binary search. Signals
+    are named the way gtkwave names its facilities, i.e. scopes joined by '.'
+    with the bit range appended for vectors.
+
+    The trace is decoded incrementally through :meth:`feed`, which has to be
+    given data that ends on a token boundary.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.names = {}
+        self.signals = {}
+        self.time = 0
+        self.scope = []
+        self.in_header = True
+
+    def close(self):
+        self.clear()
+
+    def feed(self, data):
+        tokens = iter(data.split())
+        for tok in tokens:
+            if self.in_header:
+                self._header_token(tok, tokens)
+            else:
+                self._value_token(tok, tokens)
+
+    def _header_token(self, tok, tokens):
+        if tok == '$scope':
+            next(tokens)
+            self.scope.append(next(tokens))
+            _skip_to_end(tokens)
+        elif tok == '$upscope':
+            self.scope.pop()
+            _skip_to_end(tokens)
+        elif tok == '$var':
+            args = _read_to_end(tokens)
+            self._register_var(*args[1:4], args[4:])
+        elif tok == '$enddefinitions':
+            _skip_to_end(tokens)
+            self.in_header = False
+        elif tok.startswith('$'):
+            _skip_to_end(tokens)
+
+    def _register_var(self, size, code, ref, bit_range):
+        name = '.'.join(self.scope + [ref])
+
+        if code not in self.signals:
+            self.signals[code] = VCDSignal(code)
+
+        self.names[name] = code
+        if bit_range:
+            self.names[name + ''.join(bit_range)] = code
+        elif int(size) > 1 and not ref.endswith(']'):
+            self.names[f'{name}[{int(size) - 1}:0]'] = code
+
+    def _value_token(self, tok, tokens):
+        head = tok[0]
+        if head == '#':
+            self.time = int(tok[1:])
+        elif head in 'bBrRsS':
+            self._change(next(tokens), tok[1:])
+        elif head == '$':
+            if tok in ('$comment', '$date', '$version', '$timescale'):
+                _skip_to_end(tokens)
+        else:
+            self._change(tok[1:], head)
+
+    def _change(self, code, val):
+        sig = self.signals.get(code, None)
+        if sig is not None:
+            sig.change(self.time, val)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def signal(self, name):
+        return self.signals[self.names[name]]
+
+    def value_at(self, name, time, default=None):
+        try:
+            sig = self.signal(name)
+        except KeyError:
+            return default
+
+        return sig.value_at(time, default)
+
+    @property
+    def end_time(self):
+        return self.time
+
+
+class VCDTailer:
+    """Incrementally decodes a VCD file that is still being written.
+
+    The file is memory mapped on each :meth:`poll` and only the part appended
+    since the last parsed byte offset is decoded into the index, so the cost
+    of a poll depends on the amount of new data, not the total trace length.
+    """
+
+    def __init__(self, trace_fn, index=None):
+        self.trace_fn = trace_fn
+        self.index = VCDIndex() if index is None else index
+        self.offset = 0
+
+    @property
+    def timestamp(self):
+        return self.index.time
+
+    def poll(self, max_size=None):
+        """Decodes value changes appended since the last poll.
+
+        If max_size is given, at most that many bytes are decoded in one call.
+        Returns True if any new data was decoded.
+        """
+        try:
+            size = os.stat(self.trace_fn).st_size
+        except OSError:
+            return False
+
+        if size < self.offset:
+            # Trace was rewritten, i.e. simulation was restarted
+            self.index.clear()
+            self.offset = 0
+
+        if size == self.offset:
+            return False
+
+        limit = size
+        if max_size is not None:
+            limit = min(size, self.offset + max_size)
+
+        with open(self.trace_fn, 'rb') as f:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                end = self._chunk_end(mm, limit)
+                # Grow the chunk until it holds at least one complete construct
+                while end <= self.offset and limit < size:
+                    limit = min(size, 2 * limit - self.offset)
+                    end = self._chunk_end(mm, limit)
+
+                if end <= self.offset:
+                    return False
+
+                data = mm[self.offset:end]
+
+        self.offset = end
+        self.index.feed(data.decode(errors='replace'))
+
+        return True
+
+    def _chunk_end(self, mm, limit):
+        # Decode only up to the last complete construct, the rest is left for
+        # the next poll when the writer has flushed it
+        if self.index.in_header:
+            end = limit
+            while True:
+                end = mm.rfind(b'$end', self.offset, end)
+                if end < 0:
+                    return self.offset
+
+                # Skip '$end' that is only a prefix of '$enddefinitions'
+                tail = end + len(b'$end')
+                if tail < limit and mm[tail:tail + 1].isspace():
+                    return tail
+
+        return mm.rfind(b'\n', self.offset, limit) + 1
+
+
+def _skip_to_end(tokens):
+    for tok in tokens:
+        if tok == '$end':
+            return
+
+
+def _read_to_end(tokens):
+    args = []
+    for tok in tokens:
+        if tok == '$end':
+            break
+
+        args.append(tok)
+
+    return args